@@ -0,0 +1,133 @@
+"""
+Server clock synchronisation
+Estimates how far the game clock is from the local one so timed sends land on the planned second
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from core.extractors import Extractor
+
+
+class ClockSync:
+    """
+    Keeps the interval the server clock offset must lie in, narrowed by every response
+    A response was generated between sending the request and receiving it, so each server timestamp bounds
+    the offset from both sides. Bounds from older samples widen slowly to allow for local clock drift.
+    """
+    # How much the local clock may drift, in seconds per second
+    drift = 5e-5
+    # Weight of the newest round trip in the moving average
+    rtt_weight = 0.2
+    # The last part of a wait is spent busy-waiting, sleep() is not precise enough for it
+    spin = 0.002
+    logger = logging.getLogger("ClockSync")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.low = None
+        self.high = None
+        self.updated = time.monotonic()
+        self.rtt = None
+        self.samples = 0
+
+    def observe(self, response, sent, received):
+        """
+        Feeds the server timestamps of a response, sent and received are the local times around the request
+        """
+        if response is None:
+            return
+        if self.rtt is None:
+            self.rtt = received - sent
+        else:
+            self.rtt += self.rtt_weight * ((received - sent) - self.rtt)
+        date = response.headers.get("Date") if hasattr(response, "headers") else None
+        if date:
+            try:
+                server = parsedate_to_datetime(date).timestamp()
+            except (TypeError, ValueError):
+                server = None
+            if server:
+                # The header is truncated to whole seconds
+                self.add(server - received, server + 1 - sent)
+        game_data = Extractor.game_state(response)
+        generated = game_data.get("time_generated") if isinstance(game_data, dict) else None
+        if generated:
+            generated = float(generated)
+            # Milliseconds on current worlds, seconds on older ones
+            if generated > 1e11:
+                generated /= 1000
+            self.add(generated - received, generated - sent)
+
+    def add(self, low, high):
+        """
+        Intersects the known offset interval with a new one, restarting from it when they do not overlap
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.low is not None:
+                widen = (now - self.updated) * self.drift
+                current_low, current_high = self.low - widen, self.high + widen
+                if low <= current_high and high >= current_low:
+                    low, high = max(low, current_low), min(high, current_high)
+                else:
+                    self.logger.debug("Server clock moved, resetting offset estimate")
+            self.low, self.high = low, high
+            self.updated = now
+            self.samples += 1
+
+    @property
+    def offset(self):
+        """
+        Best guess of server time minus local time in seconds
+        """
+        if self.low is None:
+            return 0.0
+        return (self.low + self.high) / 2
+
+    @property
+    def uncertainty(self):
+        """
+        Half the width of the offset interval in seconds
+        """
+        if self.low is None:
+            return None
+        return (self.high - self.low) / 2
+
+    def server_time(self):
+        """
+        Current time on the server clock
+        """
+        return time.time() + self.offset
+
+    def to_monotonic(self, server_timestamp):
+        """
+        Converts a moment on the server clock to the local monotonic clock
+        """
+        return time.monotonic() + (server_timestamp - self.server_time())
+
+    def sleep_until(self, server_timestamp, progress=None):
+        """
+        Waits for a moment on the server clock, returns how late it woke up in seconds
+        The deadline is recomputed every second so offset updates during long waits are picked up,
+        progress is called with the remaining seconds during the coarse phase
+        """
+        while True:
+            deadline = self.to_monotonic(server_timestamp)
+            remaining = deadline - time.monotonic()
+            if remaining <= self.spin:
+                break
+            if progress:
+                progress(remaining)
+            time.sleep(min(remaining - self.spin, 1.0))
+        while time.monotonic() < deadline:
+            pass
+        return time.monotonic() - deadline
+
+    def describe(self):
+        if self.low is None:
+            return "no server time samples yet"
+        return "offset %+.0f ms ±%.0f ms, round trip %.0f ms, %d samples" % (
+            self.offset * 1000, self.uncertainty * 1000, (self.rtt or 0) * 1000, self.samples
+        )
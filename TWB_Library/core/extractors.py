@@ -5,22 +5,102 @@ File used for data extraction
 import json
 import re
 
+# Everything the bot reads from (almost) every response, collected once per response
+# Separate literal-prefixed patterns are much faster in CPython than one big alternation
+GAME_DATA = re.compile(r'TribalWars\.updateGameData\((.+?)\);')
+QUEST_DATA = re.compile(r'Quests\.setQuestData\((\{.+?\})\);')
+VILLAGE_DATA = re.compile(r'var village = (.+);')
+PAGE_FIELDS = (
+    ("csrf", re.compile(r'<meta content="(.+?)" name="csrf-token"')),
+    ("h", re.compile(r'&h=(\w+)')),
+    ("game_data", GAME_DATA),
+    ("quests", QUEST_DATA),
+    ("village", VILLAGE_DATA),
+)
+BOT_PROTECT_MARKER = 'data-bot-protect="forced"'
+
+BUILDING_DATA = re.compile(r'(?s)BuildingMain.buildings = (\{.+?\});')
+QUEST_REWARDS = re.compile(r'RewardSystem\.setRewards\(\s*(\[\{.+?\}\]),')
+MAP_DATA = re.compile(r'(?s)TWMap.sectorPrefech = (\[(.+?)\]);')
+SMITH_DATA = re.compile(r'(?s)BuildingSmith.techs = (\{.+?\});')
+PREMIUM_DATA = re.compile(r'(?s)PremiumExchange.receiveData\((.+?)\);')
+RECRUIT_DATA = re.compile(r'(?s)unit_managers.units = (\{.+?\});')
+QUOTE_KEYS = re.compile(r'([\{\s,])(\w+)(:)')
+UNITS_HOME = re.compile(r'<table id="units_home".*?</tr>(.*?)</tr>', re.DOTALL)
+UNIT_ITEMS = re.compile(r'class=\'unit-item unit-item-(.*?)\'[^>]*>(\d+)</td>')
+TOOLTIP = re.compile(r'\s*tooltip\s*')
+BUILD_QUEUE = re.compile(r'(?s)<table id="build_queue"(.+?)</table>')
+RECRUIT_QUEUE = re.compile(r'(?s)TrainOverview\.cancelOrder\((\d+)\)')
+OVERVIEW_VILLAGES = re.compile(r'<span class="quickedit-vn" data-id="(\w+)"')
+VILLAGE_ANCHOR = re.compile(r'(?s)<span class="village_anchor.+?</tr>')
+UNITS_TOTAL = re.compile(r'(?s)class=\Wunit-item unit-item-([a-z]+)\W.+?(\d+)</td>')
+ATTACK_FORM = re.compile(r'(?s)<input.+?name="(.+?)".+?value="(.*?)"')
+ATTACK_DURATION = re.compile(r'<span class="relative_time" data-duration="(\d+)"')
+REPORT_LINKS = re.compile(r'(?s)class="report-link" data-id="(\d+)"')
+DAILY_BONUS = re.compile(r'DailyBonus.init\((\s+\{.*\}),')
+
 
 class Extractor:
     """
-    Defines various non-compiled regexes for data retrieval
-    TODO: use compiled various for CPU efficiency
+    Defines the compiled regexes for data retrieval
+    Parsed JSON blobs are remembered on the response, so treat them as read-only
     """
+    @staticmethod
+    def scan_page(text):
+        """
+        Collects csrf token, h, game data, quest data, village data and the bot protection flag of a page
+        Only the first occurrence of every field is kept
+        """
+        meta = {}
+        for field, pattern in PAGE_FIELDS:
+            found = pattern.search(text)
+            meta[field] = found.group(1) if found else None
+        meta["bot_protect"] = BOT_PROTECT_MARKER in text
+        return meta
+
+    @staticmethod
+    def page_meta(res):
+        """
+        Returns the scanned metadata of a response, None for plain text
+        """
+        return getattr(res, "page_meta", None) if type(res) != str else None
+
+    @staticmethod
+    def memoize(res, key, parse):
+        """
+        Runs parse(text) once per response object and hands out the stored result afterwards
+        """
+        if type(res) == str:
+            return parse(res)
+        cache = res.__dict__.setdefault("parsed_cache", {})
+        if key not in cache:
+            cache[key] = parse(res.text)
+        return cache[key]
+
+    @staticmethod
+    def load_match(pattern, text):
+        """
+        Decodes the JSON captured by the first group of a pattern, None if it is not on the page
+        """
+        found = pattern.search(text)
+        if found:
+            return json.loads(found.group(1), strict=False)
+        return None
+
     @staticmethod
     def village_data(res):
         """
         Detects village data on a page
         """
-        if type(res) != str:
-            res = res.text
-        grabber = re.search(r'var village = (.+);', res)
-        if grabber:
-            data = grabber.group(1)
+        meta = Extractor.page_meta(res)
+        if meta is not None:
+            data = meta["village"]
+        else:
+            if type(res) != str:
+                res = res.text
+            grabber = VILLAGE_DATA.search(res)
+            data = grabber.group(1) if grabber else None
+        if data:
             return json.loads(data, strict=False)
 
     @staticmethod
@@ -28,36 +108,34 @@ class Extractor:
         """
         Detects the game state that is available on most pages
         """
-        if type(res) != str:
-            res = res.text
-        grabber = re.search(r'TribalWars\.updateGameData\((.+?)\);', res)
-        if grabber:
-            data = grabber.group(1)
-            return json.loads(data, strict=False)
+        meta = Extractor.page_meta(res)
+        if meta is not None:
+            data = meta["game_data"]
+            return Extractor.memoize(res, "game_state", lambda _: json.loads(data, strict=False) if data else None)
+        return Extractor.memoize(res, "game_state", lambda text: Extractor.load_match(GAME_DATA, text))
 
     @staticmethod
     def building_data(res):
         """
         Fetches building data from the main building
         """
-        if type(res) != str:
-            res = res.text
-        dre = re.search(r'(?s)BuildingMain.buildings = (\{.+?\});', res)
-        if dre:
-            return json.loads(dre.group(1), strict=False)
-
-        return None
+        return Extractor.memoize(res, "building_data", lambda text: Extractor.load_match(BUILDING_DATA, text))
 
     @staticmethod
     def get_quests(res):
         """
         Gets quest data on almost any page
         """
-        if type(res) != str:
-            res = res.text
-        get_quests = re.search(r'Quests.setQuestData\((\{.+?\})\);', res)
-        if get_quests:
-            result = json.loads(get_quests.group(1), strict=False)
+        meta = Extractor.page_meta(res)
+        if meta is not None:
+            data = meta["quests"]
+        else:
+            if type(res) != str:
+                res = res.text
+            get_quests = QUEST_DATA.search(res)
+            data = get_quests.group(1) if get_quests else None
+        if data:
+            result = json.loads(data, strict=False)
             for quest in result:
                 data = result[quest]
                 if data['goals_completed'] == data['goals_total']:
@@ -71,7 +149,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        get_rewards = re.search(r'RewardSystem\.setRewards\(\s*(\[\{.+?\}\]),', res)
+        get_rewards = QUEST_REWARDS.search(res)
         rewards = []
         if get_rewards:
             result = json.loads(get_rewards.group(1), strict=False)
@@ -88,7 +166,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        data = re.search(r'(?s)TWMap.sectorPrefech = (\[(.+?)\]);', res)
+        data = MAP_DATA.search(res)
         if data:
             result = json.loads(data.group(1), strict=False)
             return result
@@ -98,41 +176,28 @@ class Extractor:
         """
         Gets smith data
         """
-        if type(res) != str:
-            res = res.text
-        data = re.search(r'(?s)BuildingSmith.techs = (\{.+?\});', res)
-        if data:
-            result = json.loads(data.group(1), strict=False)
-            return result
-        return None
+        return Extractor.memoize(res, "smith_data", lambda text: Extractor.load_match(SMITH_DATA, text))
 
     @staticmethod
     def premium_data(res):
         """
         Detects data on the premium exchange page
         """
-        if type(res) != str:
-            res = res.text
-        data = re.search(r'(?s)PremiumExchange.receiveData\((.+?)\);', res)
-        if data:
-            result = json.loads(data.group(1), strict=False)
-            return result
-        return None
+        return Extractor.memoize(res, "premium_data", lambda text: Extractor.load_match(PREMIUM_DATA, text))
 
     @staticmethod
     def recruit_data(res):
         """
         Fetches recruit data for the current building
         """
-        if type(res) != str:
-            res = res.text
-        data = re.search(r'(?s)unit_managers.units = (\{.+?\});', res)
-        if data:
-            raw = data.group(1)
-            quote_keys_regex = r'([\{\s,])(\w+)(:)'
-            processed = re.sub(quote_keys_regex, r'\1"\2"\3', raw)
-            result = json.loads(processed, strict=False)
-            return result
+        def parse(text):
+            data = RECRUIT_DATA.search(text)
+            if data:
+                processed = QUOTE_KEYS.sub(r'\1"\2"\3', data.group(1))
+                return json.loads(processed, strict=False)
+            return None
+
+        return Extractor.memoize(res, "recruit_data", parse)
 
     @staticmethod
     def units_in_village(res):
@@ -141,13 +206,13 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        matches = re.search(r'<table id="units_home".*?</tr>(.*?)</tr>', res, re.DOTALL)
+        matches = UNITS_HOME.search(res)
         # We get the start of the table and grab the 2nd row (Where "From this village" troops are located)
         if matches:
             table_content = matches.group(1)
-            unit_matches = re.findall(r'class=\'unit-item unit-item-(.*?)\'[^>]*>(\d+)</td>', table_content)
+            unit_matches = UNIT_ITEMS.findall(table_content)
             # Find all the tuples (name, quantity) under the class "unit-item unit-item-*troop_name*"
-            units = [(re.sub(r'\s*tooltip\s*', '', unit_name), unit_quantity) for unit_name, unit_quantity in
+            units = [(TOOLTIP.sub('', unit_name), unit_quantity) for unit_name, unit_quantity in
                      unit_matches if int(unit_quantity) > 0]
             # Filter units with quantity = 0, also for the Paladin,
             # the name would be "knight tooltip", so we had to remove that.
@@ -161,7 +226,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        builder = re.search('(?s)<table id="build_queue"(.+?)</table>', res)
+        builder = BUILD_QUEUE.search(res)
         if not builder:
             return 0
 
@@ -174,7 +239,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        builder = re.findall(r'(?s)TrainOverview\.cancelOrder\((\d+)\)', res)
+        builder = RECRUIT_QUEUE.findall(res)
         return builder
 
     @staticmethod
@@ -184,7 +249,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        villages = re.findall(r'<span class="quickedit-vn" data-id="(\w+)"', res)
+        villages = OVERVIEW_VILLAGES.findall(res)
         return list(set(villages))
 
     @staticmethod
@@ -195,8 +260,8 @@ class Extractor:
         if type(res) != str:
             res = res.text
         # hide units from other villages
-        res = re.sub(r'(?s)<span class="village_anchor.+?</tr>', '', res)
-        data = re.findall(r'(?s)class=\Wunit-item unit-item-([a-z]+)\W.+?(\d+)</td>', res)
+        res = VILLAGE_ANCHOR.sub('', res)
+        data = UNITS_TOTAL.findall(res)
         return data
 
     @staticmethod
@@ -207,7 +272,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        data = re.findall(r'(?s)<input.+?name="(.+?)".+?value="(.*?)"', res)
+        data = ATTACK_FORM.findall(res)
         return data
 
     @staticmethod
@@ -217,7 +282,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        data = re.search(r'<span class="relative_time" data-duration="(\d+)"', res)
+        data = ATTACK_DURATION.search(res)
         if data:
             return int(data.group(1))
         return 0
@@ -229,7 +294,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        data = re.findall(r'(?s)class="report-link" data-id="(\d+)"', res)
+        data = REPORT_LINKS.findall(res)
         return data
 
     @staticmethod
@@ -239,7 +304,7 @@ class Extractor:
         """
         if type(res) != str:
             res = res.text
-        get_daily = re.search(r'DailyBonus.init\((\s+\{.*\}),', res)
+        get_daily = DAILY_BONUS.search(res)
         res = json.loads(get_daily.group(1))
         reward_count_unlocked = str(res["reward_count_unlocked"])
         if reward_count_unlocked and res["chests"][reward_count_unlocked]["is_collected"]:
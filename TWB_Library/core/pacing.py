@@ -0,0 +1,108 @@
+"""
+Request pacing
+Keeps human-like spacing between requests while the bot keeps working in between
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Priority:
+    """
+    Request classes, lower values go first
+    """
+    CRITICAL = 0  # Timed sends of the hunter
+    BACKGROUND = 1  # Builder, recruiting, farming, reports, market...
+
+    names = {CRITICAL: "critical", BACKGROUND: "background"}
+
+
+class RequestScheduler:
+    """
+    Orders the requests of all threads by priority and tracks the earliest moment each class may send again
+    Parsing, cache writes and decisions made after a request count towards the delay instead of adding to it
+    A request only goes out when no request of a higher class is waiting and no critical block is running
+    """
+    # Spacing after a request of each class, as a (min, max) multiple of the delay factor in seconds
+    spacing = {
+        Priority.CRITICAL: (0, 0),
+        Priority.BACKGROUND: (3, 7),
+    }
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.next_allowed = {level: 0.0 for level in self.spacing}
+        self.waiting = {level: 0 for level in self.spacing}
+        # Thread running a critical block, everybody else waits until it ends
+        self.critical_thread = None
+        self.local = threading.local()
+
+    @property
+    def level(self):
+        """
+        Priority of the requests of the calling thread
+        """
+        return getattr(self.local, "level", Priority.BACKGROUND)
+
+    @contextmanager
+    def critical(self):
+        """
+        Sends the requests of the block without delay and holds every other thread at its next request
+        """
+        me = threading.get_ident()
+        with self.condition:
+            while self.critical_thread not in (None, me):
+                self.condition.wait()
+            owner = self.critical_thread is None
+            self.critical_thread = me
+        previous = self.level
+        self.local.level = Priority.CRITICAL
+        try:
+            yield
+        finally:
+            self.local.level = previous
+            if owner:
+                with self.condition:
+                    self.critical_thread = None
+                    self.condition.notify_all()
+
+    def blocked(self, level):
+        """
+        Seconds a request of a class still has to wait, None while it has to give way to another one
+        """
+        if self.critical_thread not in (None, threading.get_ident()):
+            return None
+        if any(self.waiting[higher] for higher in self.waiting if higher < level):
+            return None
+        return max(0.0, self.next_allowed[level] - time.monotonic())
+
+    def schedule(self, delay=1.0):
+        """
+        Called when a request finishes, picks the spacing before the next one of the same class
+        """
+        level = self.level
+        low, high = self.spacing[level]
+        with self.condition:
+            self.next_allowed[level] = time.monotonic() + random.randint(int(low * delay), int(high * delay))
+
+    def wait(self):
+        """
+        Blocks until a request of the calling thread is allowed and returns the time actually waited
+        Waiting lower classes are woken up when a higher class request shows up, so they give way right away
+        """
+        level = self.level
+        started = time.monotonic()
+        with self.condition:
+            self.waiting[level] += 1
+            self.condition.notify_all()
+            try:
+                while True:
+                    remaining = self.blocked(level)
+                    if remaining == 0:
+                        break
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting[level] -= 1
+                self.condition.notify_all()
+        return time.monotonic() - started
@@ -0,0 +1,126 @@
+"""
+Request accounting for the web wrapper
+Shows where the time of a bot cycle goes
+"""
+import logging
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qs
+
+from core.filemanager import FileManager
+
+
+class RequestProfiler:
+    """
+    Records every request and builds a per-village and per-phase breakdown of a cycle
+    """
+    # Maps the module that triggered a request to the phase it is accounted to
+    phases = {
+        "game.buildingmanager": "builder",
+        "game.troopmanager": "troops",
+        "game.attack": "farm",
+        "game.farm_assistant": "farm",
+        "game.map": "map",
+        "game.reports": "reports",
+        "game.resources": "market",
+        "game.defence_manager": "defence",
+        "game.snobber": "snob",
+        "game.hunter": "hunter",
+        "game.village": "village",
+        "pages.overview": "overview",
+    }
+    logger = logging.getLogger("Profiler")
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self.started = time.time()
+
+    def start_cycle(self):
+        """
+        Drops the records of the previous cycle
+        """
+        self.records = []
+        self.started = time.time()
+
+    def caller_phase(self):
+        """
+        Walks up the stack until a known manager is found
+        """
+        frame = sys._getframe(1)
+        while frame:
+            name = frame.f_globals.get("__name__", "")
+            if name in self.phases:
+                return self.phases[name]
+            frame = frame.f_back
+        return "other"
+
+    def record(self, method, url, response=None, sleep=0.0, wall=0.0, cached=False):
+        """
+        Stores a single request entry
+        """
+        if not self.enabled:
+            return
+        query = parse_qs(urlparse(url).query)
+        self.records.append({
+            "time": time.time(),
+            "method": method,
+            "screen": query.get("screen", [None])[0],
+            "action": query.get("ajaxaction", query.get("ajax", query.get("action", [None])))[0],
+            "village": query.get("village", [None])[0],
+            "phase": self.caller_phase(),
+            "sleep": round(sleep, 3),
+            "wall": round(wall, 3),
+            "bytes": len(response.content) if response is not None else 0,
+            "status": response.status_code if response is not None else None,
+            "cached": cached,
+        })
+
+    def summary(self):
+        """
+        Aggregates the records per village and per phase
+        """
+        def bucket():
+            return {"requests": 0, "cached": 0, "sleep": 0.0, "wall": 0.0, "bytes": 0}
+
+        totals = bucket()
+        villages = defaultdict(bucket)
+        phases = defaultdict(bucket)
+        for entry in self.records:
+            for target in (totals, villages[entry["village"] or "account"], phases[entry["phase"]]):
+                target["requests"] += 1
+                target["cached"] += 1 if entry["cached"] else 0
+                target["sleep"] += entry["sleep"]
+                target["wall"] += entry["wall"]
+                target["bytes"] += entry["bytes"]
+        return {
+            "started": int(self.started),
+            "duration": round(time.time() - self.started, 3),
+            "totals": totals,
+            "villages": dict(villages),
+            "phases": dict(phases),
+        }
+
+    def flush(self, path="cache/logs/cycle_profile.json"):
+        """
+        Writes the cycle breakdown to disk and logs a short summary
+        """
+        if not self.enabled or not self.records:
+            return None
+        output = self.summary()
+        totals = output["totals"]
+        self.logger.info(
+            "Cycle took %.1fs: %d requests (%d cached), %.1fs request delay, %.1fs network, %.2f MB",
+            output["duration"], totals["requests"], totals["cached"],
+            totals["sleep"], totals["wall"], totals["bytes"] / 1048576
+        )
+        for phase, data in sorted(output["phases"].items(), key=lambda x: -(x[1]["sleep"] + x[1]["wall"])):
+            self.logger.info(
+                "  %-10s %4d requests %7.1fs delay %7.1fs network",
+                phase, data["requests"], data["sleep"], data["wall"]
+            )
+        output["requests"] = self.records
+        FileManager.save_json_file(output, path)
+        self.start_cycle()
+        return output
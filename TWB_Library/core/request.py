@@ -6,10 +6,12 @@ CORRIGIDO para sistema multi-contas com sistema de CAPTCHA flag
 import requests
 import logging
 import re
+import threading
 import time
-import random
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from urllib.parse import urljoin, urlencode
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlencode, urlparse, parse_qs
 
 # Importa contexto para multi-contas
 try:
@@ -25,11 +27,92 @@ except ImportError:
                 return Path(os.getcwd()) / "cache" / subdir
             return Path(os.getcwd()) / "cache"
 
+from core.clock import ClockSync
+from core.extractors import Extractor
 from core.filemanager import FileManager
 from core.notification import Notification
+from core.pacing import RequestScheduler
+from core.profiler import RequestProfiler
 from core.reporter import ReporterObject
 
 
+class PageCache:
+    """
+    Cycle-scoped cache for plain GET pages
+    Repeated reads of the same URL are served from memory until the village is touched
+    """
+    # Query parameters that mark a request as an action instead of a page read
+    action_params = {"action", "ajaxaction", "ajax", "try", "h"}
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # The hunter daemon reads and invalidates pages while the village loop does
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def parse(url):
+        """
+        Returns the query parameters of an URL
+        """
+        return parse_qs(urlparse(url).query)
+
+    def is_cacheable(self, url):
+        """
+        Only page reads can be cached, anything that changes game state can not
+        """
+        return not self.action_params.intersection(self.parse(url))
+
+    def get(self, url):
+        """
+        Returns a cached response or None
+        """
+        if not self.enabled:
+            return None
+        with self.lock:
+            res = self.entries.get(url)
+            if res is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return res
+
+    def store(self, url, response):
+        """
+        Stores a valid game page
+        """
+        if not self.enabled or response.status_code != 200 or "game.php" not in response.url:
+            return
+        village = self.parse(url).get("village", [None])[0]
+        response.cache_village = village
+        with self.lock:
+            self.entries[url] = response
+
+    def invalidate(self, url=None):
+        """
+        Drops the pages of the village an action was executed on
+        Pages without a village parameter are dropped as well because they might be affected
+        """
+        village = self.parse(url).get("village", [None])[0] if url else None
+        with self.lock:
+            if not village:
+                self.entries = {}
+                return
+            self.entries = {
+                k: v for k, v in self.entries.items()
+                if v.cache_village and v.cache_village != village
+            }
+
+    def clear(self):
+        """
+        Starts a new cycle
+        """
+        with self.lock:
+            self.entries = {}
+
+
 class WebWrapper:
     """
     WebWrapper object for sending HTTP requests
@@ -43,38 +126,72 @@ class WebWrapper:
     endpoint = None
     logger = logging.getLogger("Requests")
     server = None
-    last_response = None
     last_h = None
-    priority_mode = False
     auth_endpoint = None
     reporter = None
     delay = 1.0
+    # Max connections kept open to the game server, bounds the concurrency of a dispatch
+    pool_size = 16
 
     def __init__(self, url, server=None, endpoint=None, reporter_enabled=False, reporter_constr=None):
         """
         Construct the session and detect variables
         """
         self.web = requests.session()
+        # The village loop and the hunter daemon share the session, headers and h token are guarded by lock
+        self.headers = dict(self.headers)
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+        self.web.mount("https://", adapter)
+        self.web.mount("http://", adapter)
         self.auth_endpoint = url
         self.server = server
         self.endpoint = endpoint
         self.reporter = ReporterObject(enabled=reporter_enabled, connection_string=reporter_constr)
+        self.page_cache = PageCache()
+        self.profiler = RequestProfiler()
+        self.scheduler = RequestScheduler()
+        self.clock = ClockSync()
+
+    @property
+    def last_response(self):
+        """
+        Last response of the calling thread, a page read is never replaced by a request of another thread
+        """
+        return getattr(self.local, "response", None)
+
+    @last_response.setter
+    def last_response(self, response):
+        self.local.response = response
+
+    def request_headers(self):
+        """
+        Copy of the session headers for a single request, another thread may update them while it is in flight
+        """
+        with self.lock:
+            return dict(self.headers)
 
     def post_process(self, response):
         """
         Post-processes all requests and stores data used for the next request
+        The page is scanned once, the results are attached to the response for the extractors
         """
-        xsrf = re.search('<meta content="(.+?)" name="csrf-token"', response.text)
-        if xsrf:
-            self.headers['x-csrf-token'] = xsrf.group(1)
+        meta = getattr(response, "page_meta", None)
+        if meta is None:
+            meta = Extractor.scan_page(response.text)
+            response.page_meta = meta
+        with self.lock:
+            if meta["csrf"]:
+                self.headers['x-csrf-token'] = meta["csrf"]
+            elif 'x-csrf-token' in self.headers:
+                del self.headers['x-csrf-token']
+            self.headers['Referer'] = response.url
+            if meta["h"]:
+                self.last_h = meta["h"]
+        if meta["csrf"]:
             self.logger.debug("Set CSRF token")
-        elif 'x-csrf-token' in self.headers:
-            del self.headers['x-csrf-token']
-        self.headers['Referer'] = response.url
         self.last_response = response
-        get_h = re.search(r'&h=(\w+)', response.text)
-        if get_h:
-            self.last_h = get_h.group(1)
 
     def _get_captcha_flag_path(self):
         """
@@ -126,21 +243,39 @@ class WebWrapper:
     def get_url(self, url, headers=None):
         """
         Fetches a URL using a basic GET request
+        Page reads are served from the cycle cache when possible
         MODIFICADO - Sistema de CAPTCHA flag
         """
-        self.headers['Origin'] = (self.endpoint if self.endpoint else self.auth_endpoint).rstrip('/')
-        if not self.priority_mode:
-            time.sleep(random.randint(int(3 * self.delay), int(7 * self.delay)))
+        with self.lock:
+            self.headers['Origin'] = (self.endpoint if self.endpoint else self.auth_endpoint).rstrip('/')
         url = urljoin(self.endpoint if self.endpoint else self.auth_endpoint, url)
+        cacheable = self.page_cache.is_cacheable(url)
+        if cacheable:
+            cached = self.page_cache.get(url)
+            if cached is not None:
+                self.logger.debug("GET %s [cached]", url)
+                self.profiler.record("GET", url, cached, cached=True)
+                self.post_process(cached)
+                return cached
+        else:
+            # GET actions (quick build, snob training...) change the village as well
+            self.page_cache.invalidate(url)
+        sleep = self.scheduler.wait()
         if not headers:
-            headers = self.headers
+            headers = self.request_headers()
+        started = time.time()
         try:
             res = self.web.get(url=url, headers=headers)
+            received = time.time()
+            # Parsing the response happens during the delay before the next request
+            self.scheduler.schedule(self.delay)
+            self.profiler.record("GET", url, res, sleep=sleep, wall=received - started)
             self.logger.debug("GET %s [%d]", url, res.status_code)
             self.post_process(res)
+            self.clock.observe(res, started, received)
             
             # Verifica proteção de bot
-            if 'data-bot-protect="forced"' in res.text:
+            if res.page_meta["bot_protect"]:
                 self.logger.warning("Bot protection detected")
                 self.reporter.report(0, "TWB_RECAPTCHA", "CAPTCHA detected - waiting for resolution")
                 
@@ -149,9 +284,13 @@ class WebWrapper:
                 
                 # Tenta novamente após resolução
                 return self.get_url(url, headers)
-            
+
+            if cacheable:
+                self.page_cache.store(url, res)
             return res
         except Exception as e:
+            self.scheduler.schedule(self.delay)
+            self.profiler.record("GET", url, sleep=sleep, wall=time.time() - started)
             self.logger.warning("GET %s: %s", url, str(e))
             return None
 
@@ -159,21 +298,28 @@ class WebWrapper:
         """
         Sends a basic POST request with urlencoded postdata
         """
-        if not self.priority_mode:
-            time.sleep(random.randint(int(3 * self.delay), int(7 * self.delay)))
-        
-        self.headers['Origin'] = (self.endpoint if self.endpoint else self.auth_endpoint).rstrip('/')
+        sleep = self.scheduler.wait()
+
+        with self.lock:
+            self.headers['Origin'] = (self.endpoint if self.endpoint else self.auth_endpoint).rstrip('/')
         url = urljoin(self.endpoint if self.endpoint else self.auth_endpoint, url)
+        # Every POST changes the state of the village it was sent from
+        self.page_cache.invalidate(url)
         enc = urlencode(data)
         if not headers:
-            headers = self.headers
+            headers = self.request_headers()
+        started = time.time()
         try:
             res = self.web.post(url=url, data=data, headers=headers)
+            received = time.time()
+            self.scheduler.schedule(self.delay)
+            self.profiler.record("POST", url, res, sleep=sleep, wall=received - started)
             self.logger.debug("POST %s %s [%d]", url, enc, res.status_code)
             self.post_process(res)
+            self.clock.observe(res, started, received)
             
             # Verifica proteção também em POST
-            if 'data-bot-protect="forced"' in res.text:
+            if res.page_meta["bot_protect"]:
                 self.logger.warning("Bot protection detected on POST request")
                 self.reporter.report(0, "TWB_RECAPTCHA", "CAPTCHA detected on POST - waiting for resolution")
                 
@@ -185,6 +331,8 @@ class WebWrapper:
             
             return res
         except Exception as e:
+            self.scheduler.schedule(self.delay)
+            self.profiler.record("POST", url, sleep=sleep, wall=time.time() - started)
             self.logger.warning("POST %s %s: %s", url, enc, str(e))
             return None
 
@@ -407,7 +555,7 @@ class WebWrapper:
         """
         Fetches API data from a specific village and action
         """
-        custom = dict(self.headers)
+        custom = self.request_headers()
         custom['accept'] = "application/json, text/javascript, */*; q=0.01"
         custom['x-requested-with'] = "XMLHttpRequest"
         custom['tribalwars-ajax'] = "1"
@@ -431,7 +579,7 @@ class WebWrapper:
         """
         Simulates an API request
         """
-        custom = dict(self.headers)
+        custom = self.request_headers()
         custom['accept'] = "application/json, text/javascript, */*; q=0.01"
         custom['x-requested-with'] = "XMLHttpRequest"
         custom['tribalwars-ajax'] = "1"
@@ -457,24 +605,96 @@ class WebWrapper:
         """
         Simulates an API action being triggered
         """
-        custom = dict(self.headers)
-        custom['Accept'] = "application/json, text/javascript, */*; q=0.01"
-        custom['X-Requested-With'] = "XMLHttpRequest"
-        custom['TribalWars-Ajax'] = "1"
+        prepared = self.prepare_api_action(village_id, action, params=params, data=data)
+        res = self.post_url(prepared["url"], data=prepared["data"], headers=prepared["headers"])
+        if res and res.status_code == 200:
+            try:
+                return res.json()
+            except:
+                return res
+        return None
+
+    def prepare_api_action(self, village_id, action, params={}, data={}):
+        """
+        Builds the URL, headers and data of an API action without sending it, used by get_api_action and dispatch
+        """
+        headers = self.request_headers()
+        headers['Accept'] = "application/json, text/javascript, */*; q=0.01"
+        headers['X-Requested-With'] = "XMLHttpRequest"
+        headers['TribalWars-Ajax'] = "1"
+        headers['Origin'] = (self.endpoint if self.endpoint else self.auth_endpoint).rstrip('/')
         req = {
             'ajaxaction': action,
             'village': village_id,
             'screen': 'api'
         }
         req.update(params)
-        payload = f"game.php?{urlencode(req)}"
-        url = urljoin(self.endpoint, payload)
+        data = dict(data)
         if 'h' not in data:
             data['h'] = self.last_h
-        res = self.post_url(url, data=data, headers=custom)
-        if res and res.status_code == 200:
+        return {"url": urljoin(self.endpoint, f"game.php?{urlencode(req)}"), "data": data, "headers": headers}
+
+    def warm_pool(self, size):
+        """
+        Opens up to size connections at the same time so a following dispatch does not pay for TCP and TLS handshakes
+        """
+        size = min(size, self.pool_size)
+        url = (self.endpoint if self.endpoint else self.auth_endpoint)
+        barrier = threading.Barrier(size)
+        headers = self.request_headers()
+
+        def touch(_):
             try:
-                return res.json()
-            except:
-                return res
-        return None
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+            try:
+                self.web.head(url, headers=headers, timeout=5, allow_redirects=False)
+            except requests.RequestException:
+                pass
+
+        with ThreadPoolExecutor(max_workers=size) as pool:
+            list(pool.map(touch, range(size)))
+
+    def dispatch(self, prepared, at=None, gap=0.0, concurrency=None):
+        """
+        Fires prepared POST requests over the connection pool, the n-th one gap * n seconds after the monotonic moment at
+        At most concurrency requests (pool_size without a limit) are in flight, the ones beyond follow as soon as one finishes
+        Returns (response or None, monotonic send time) per request in the given order
+        """
+        at = at if at is not None else time.monotonic()
+        workers = max(1, min(len(prepared), concurrency or self.pool_size, self.pool_size))
+
+        def fire(item):
+            index, request = item
+            moment = at + index * gap
+            remaining = moment - time.monotonic()
+            if remaining > 0.002:
+                time.sleep(remaining - 0.002)
+            while time.monotonic() < moment:
+                pass
+            sent = time.monotonic()
+            try:
+                return self.web.post(url=request["url"], data=request["data"], headers=request["headers"]), sent
+            except requests.RequestException as e:
+                self.logger.warning("POST %s: %s", request["url"], str(e))
+                return None, sent
+
+        protected = False
+        with self.scheduler.critical():
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(fire, enumerate(prepared)))
+            for (res, sent), request in zip(results, prepared):
+                # Every POST changes the state of the village it was sent from
+                self.page_cache.invalidate(request["url"])
+                self.profiler.record("POST", request["url"], res)
+                if res is not None:
+                    self.post_process(res)
+                    protected = protected or res.page_meta["bot_protect"]
+            self.scheduler.schedule(self.delay)
+        if protected:
+            # The commands are not sent again, the answers tell which ones the game took
+            self.logger.warning("Bot protection detected")
+            self.reporter.report(0, "TWB_RECAPTCHA", "CAPTCHA detected - waiting for resolution")
+            self._wait_for_captcha_resolution()
+        return results
@@ -0,0 +1,432 @@
+"""
+Entity store
+Keeps the villages, attacks and reports of an account in a single SQLite database instead of one JSON file each
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from core.filemanager import FileManager
+
+
+class EntityStore:
+    """
+    WAL-mode SQLite table of JSON entities keyed by (kind, id)
+    Writes are committed in batches, an entity written in this process is readable right away
+    """
+    path = "cache/twb.db"
+    # Kinds that used to live in their own cache directory, migrated once on first open
+    legacy_dirs = {
+        "villages": "cache/villages",
+        "attacks": "cache/attacks",
+        "reports": "cache/reports",
+    }
+    batch_size = 500
+    commit_interval = 10
+    logger = logging.getLogger("EntityStore")
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.lock = threading.RLock()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+        self.tables = {}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            "kind TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, ref TEXT, updated REAL NOT NULL, "
+            "PRIMARY KEY (kind, id))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entities_ref ON entities (kind, ref)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        atexit.register(self.flush)
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the store of the current account, opening and migrating it on first use
+        """
+        path = FileManager.get_path(cls.path).resolve()
+        with cls._instances_lock:
+            store = cls._instances.get(path)
+            if not store:
+                store = cls(path)
+                store.migrate()
+                cls._instances[path] = store
+            return store
+
+    @staticmethod
+    def ref_for(kind, entry):
+        """
+        Picks the indexed reference of an entity, reports are looked up by their destination
+        """
+        if kind == "reports" and isinstance(entry, dict) and entry.get("dest"):
+            return str(entry["dest"])
+        return None
+
+    def maybe_commit(self, written=1):
+        """
+        Commits once enough writes piled up or the last commit is old enough
+        """
+        self.pending += written
+        if self.pending >= self.batch_size or time.monotonic() - self.last_commit > self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """
+        Writes pending changes to disk
+        """
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+            self.pending = 0
+            self.last_commit = time.monotonic()
+
+    def flush(self):
+        """
+        Writes back every in-memory table and commits
+        """
+        for table in list(self.tables.values()):
+            table.flush()
+        self.commit()
+
+    def table(self, kind, max_entries=None):
+        """
+        Returns the write-back table of a kind, loaded once per store
+        """
+        with self.lock:
+            if kind not in self.tables:
+                self.tables[kind] = WriteBackTable(self, kind, max_entries=max_entries)
+            return self.tables[kind]
+
+    def get_entity(self, kind, entity_id):
+        """
+        Reads a single entity, None if it does not exist
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM entities WHERE kind = ? AND id = ?", (kind, str(entity_id))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, kind, entity_ids):
+        """
+        Reads a batch of entities as an id -> entry dict, missing ones are left out
+        """
+        entity_ids = [str(entity_id) for entity_id in entity_ids]
+        found = {}
+        with self.lock:
+            for start in range(0, len(entity_ids), self.batch_size):
+                chunk = entity_ids[start:start + self.batch_size]
+                rows = self.conn.execute(
+                    "SELECT id, data FROM entities WHERE kind = ? AND id IN (%s)" % ", ".join("?" * len(chunk)),
+                    [kind] + chunk
+                ).fetchall()
+                found.update((entity_id, json.loads(data)) for entity_id, data in rows)
+        return found
+
+    def set_entity(self, kind, entity_id, entry, updated=None):
+        """
+        Creates or replaces a single entity
+        """
+        self.set_many(kind, [(entity_id, entry)], updated=updated)
+
+    def set_many(self, kind, entries, updated=None):
+        """
+        Creates or replaces a list of (id, entry) pairs in one statement
+        """
+        now = updated or time.time()
+        rows = [
+            (kind, str(entity_id), json.dumps(entry, ensure_ascii=False), self.ref_for(kind, entry), now)
+            for entity_id, entry in entries
+        ]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entities (kind, id, data, ref, updated) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self.maybe_commit(len(rows))
+
+    def delete(self, kind, entity_id):
+        """
+        Removes a single entity
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM entities WHERE kind = ? AND id = ?", (kind, str(entity_id)))
+            self.maybe_commit()
+
+    def has(self, kind, entity_id):
+        """
+        Checks if an entity exists without decoding it
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM entities WHERE kind = ? AND id = ?", (kind, str(entity_id))
+            ).fetchone() is not None
+
+    def all(self, kind):
+        """
+        Reads every entity of a kind as an id -> entry dict
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT id, data FROM entities WHERE kind = ?", (kind,)).fetchall()
+        return {entity_id: json.loads(data) for entity_id, data in rows}
+
+    def by_ref(self, kind, ref):
+        """
+        Reads the entities of a kind with a given reference using the index
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, data FROM entities WHERE kind = ? AND ref = ?", (kind, str(ref))
+            ).fetchall()
+        return {entity_id: json.loads(data) for entity_id, data in rows}
+
+    def ids(self, kind):
+        """
+        Returns the set of known ids of a kind without decoding the entities
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT id FROM entities WHERE kind = ?", (kind,)).fetchall()
+        return {row[0] for row in rows}
+
+    def count(self, kind):
+        """
+        Counts the entities of a kind
+        """
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entities WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def overflow(self, kind, keep):
+        """
+        Reads the entities of a kind that prune would remove as an id -> entry dict
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, data FROM entities WHERE kind = ? ORDER BY updated DESC, id DESC LIMIT -1 OFFSET ?",
+                (kind, int(keep))
+            ).fetchall()
+        return {entity_id: json.loads(data) for entity_id, data in rows}
+
+    def prune(self, kind, keep):
+        """
+        Only keeps the most recently updated entities of a kind, returns how many were removed
+        """
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM entities WHERE kind = ? AND id NOT IN "
+                "(SELECT id FROM entities WHERE kind = ? ORDER BY updated DESC, id DESC LIMIT ?)",
+                (kind, kind, int(keep))
+            ).rowcount
+            self.maybe_commit(removed)
+        return removed
+
+    def get_meta(self, key, default=None):
+        """
+        Reads a store setting
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        """
+        Writes a store setting
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.maybe_commit()
+
+    def migrate(self):
+        """
+        Imports the old one-file-per-entity cache directories, only once per kind
+        The files are left in place so older versions can still be started
+        """
+        for kind, directory in self.legacy_dirs.items():
+            if self.get_meta(f"migrated:{kind}"):
+                continue
+            full_path = FileManager.get_path(directory)
+            files = FileManager.list_directory(directory, ends_with=".json")
+            if files:
+                self.logger.info("Migrating %d %s entries from %s", len(files), kind, directory)
+            imported = 0
+            for start in range(0, len(files), self.batch_size):
+                rows = []
+                for name in files[start:start + self.batch_size]:
+                    file_path = full_path / name
+                    try:
+                        with open(file_path, "r", encoding="utf-8") as f:
+                            entry = json.load(f)
+                    except (OSError, ValueError):
+                        self.logger.warning("Skipping unreadable cache file %s", file_path)
+                        continue
+                    rows.append((
+                        kind, name[:-5], json.dumps(entry, ensure_ascii=False),
+                        self.ref_for(kind, entry), os.path.getmtime(file_path)
+                    ))
+                with self.lock:
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO entities (kind, id, data, ref, updated) VALUES (?, ?, ?, ?, ?)", rows
+                    )
+                    self.conn.commit()
+                imported += len(rows)
+            self.set_meta(f"migrated:{kind}", {"time": int(time.time()), "entries": imported})
+            self.commit()
+
+    @staticmethod
+    def read_only(path, kind):
+        """
+        Reads every entity of a kind from a store owned by another process
+        """
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT id, data FROM entities WHERE kind = ?", (kind,)).fetchall()
+        finally:
+            conn.close()
+        return {entity_id: json.loads(data) for entity_id, data in rows}
+
+
+class WriteBackTable:
+    """
+    In-memory copy of the entities of a kind
+    Changes are only marked dirty and written back in one batch by flush, at most flush_interval seconds late
+    With max_entries set only the most recently used entries are kept, the rest is read from the store on demand
+    """
+    flush_interval = 60
+
+    def __init__(self, store, kind, max_entries=None):
+        self.store = store
+        self.kind = kind
+        self.max_entries = max_entries
+        self.complete = not max_entries
+        self.entries = OrderedDict(store.all(kind) if self.complete else ())
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.last_flush = time.monotonic()
+
+    def get(self, entity_id):
+        """
+        Reads an entry from memory, falling back to the store for evicted entries
+        """
+        entity_id = str(entity_id)
+        with self.lock:
+            if entity_id in self.entries:
+                self.entries.move_to_end(entity_id)
+                return self.entries[entity_id]
+            if self.complete:
+                return None
+            entry = self.store.get_entity(self.kind, entity_id)
+            if entry is not None:
+                self.entries[entity_id] = entry
+                self.evict()
+            return entry
+
+    def get_many(self, entity_ids):
+        """
+        Reads a batch of entries, the evicted ones are read from the store in one query instead of one each
+        Entries only read from the store are not kept in memory
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for entity_id in entity_ids:
+                entity_id = str(entity_id)
+                if entity_id in self.entries:
+                    found[entity_id] = self.entries[entity_id]
+                else:
+                    missing.append(entity_id)
+        if missing and not self.complete:
+            found.update(self.store.get_many(self.kind, missing))
+        return found
+
+    def set(self, entity_id, entry):
+        """
+        Updates an entry in memory and marks it for the next flush
+        """
+        self.update({entity_id: entry})
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def update(self, entries):
+        """
+        Updates a batch of entries in memory, written back by the next flush
+        """
+        with self.lock:
+            for entity_id, entry in entries.items():
+                entity_id = str(entity_id)
+                self.entries[entity_id] = entry
+                self.entries.move_to_end(entity_id)
+                self.dirty.add(entity_id)
+            self.evict()
+
+    def evict(self):
+        """
+        Drops the least recently used clean entries until the table fits, they stay available in the store
+        """
+        if not self.max_entries or len(self.entries) <= self.max_entries:
+            return
+        if len(self.dirty) > self.max_entries // 2:
+            self.flush()
+        for entity_id in list(self.entries):
+            if len(self.entries) <= self.max_entries:
+                break
+            if entity_id not in self.dirty:
+                del self.entries[entity_id]
+
+    def all(self):
+        """
+        Returns a shallow copy of all entries
+        """
+        if self.complete:
+            return dict(self.entries)
+        self.flush()
+        return self.store.all(self.kind)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def flush(self):
+        """
+        Writes the dirty entries to the store in a single batch
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            self.last_flush = time.monotonic()
+            if not dirty:
+                return 0
+            self.store.set_many(self.kind, [(entity_id, self.entries[entity_id]) for entity_id in dirty])
+        self.store.commit()
+        return len(dirty)
+
+
+class LRUCache(OrderedDict):
+    """
+    Dict that forgets the least recently used keys beyond max_entries
+    """
+
+    def __init__(self, max_entries=None):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while self.max_entries and len(self) > self.max_entries:
+            self.popitem(last=False)
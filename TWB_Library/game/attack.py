@@ -9,7 +9,8 @@ import time
 from datetime import datetime
 from datetime import timedelta
 
-from core.filemanager import FileManager
+from core.store import EntityStore
+from game.world import WorldConstants
 
 
 class AttackManager:
@@ -30,7 +31,6 @@ class AttackManager:
     farm_radius = 50
     farm_minpoints = 0
     farm_maxpoints = 1000
-    ignored = []
 
     # Configures the amount of spies used to detect if villages are safe to farm
     scout_farm_amount = 5
@@ -38,7 +38,11 @@ class AttackManager:
     forced_peace_time = None
 
     # blocks villages which cannot be attacked at the moment (too low points, beginners protection etc..)
-    _unknown_ignored = []
+    _unknown_ignored = set()
+
+    # Solve the troops needed to clear farms where scouts saw defenders instead of skipping them
+    clear_farms = False
+    clear_max_losses = 5
 
     # Don't mess with these they are in the config file
     farm_high_prio_wait = 1200
@@ -53,6 +57,8 @@ class AttackManager:
         self.village_id = village_id
         self.troopmanager = troopmanager
         self.map = map
+        self.ignored = set()
+        self.clear_troops = {}
 
     def enough_in_village(self, units):
         """
@@ -112,6 +118,8 @@ class AttackManager:
         if not missing:
             cached = self.can_attack(vid=target["id"], clear=False)
             if cached:
+                clearing = target["id"] in self.clear_troops
+                template = self.clear_troops.pop(target["id"], template)
                 attack_result = self.attack(target["id"], troops=template)
                 if attack_result == "forced_peace":
                     return 0
@@ -132,7 +140,7 @@ class AttackManager:
                     self.attacked(
                         target["id"],
                         scout=True,
-                        safe=True,
+                        safe=not clearing,
                         high_profile=cached["high_profile"]
                         if type(cached) == dict
                         else False,
@@ -145,7 +153,7 @@ class AttackManager:
                     self.logger.debug(
                         "Ignoring target %s because unable to attack", target["id"]
                     )
-                    self._unknown_ignored.append(target["id"])
+                    self._unknown_ignored.add(target["id"])
         else:
             self.logger.debug(
                 "Not sending additional farm because not enough units: %s", missing
@@ -174,15 +182,16 @@ class AttackManager:
             if self.village_id in self.map.villages
             else None
         )
-        
-        for vid in self.map.villages:
-            village = self.map.villages[vid]
-            if village["owner"] != "0" and vid not in self.extra_farm:
+        extra_farm = set(self.extra_farm)
+
+        for village, distance in self.map.in_radius(self.farm_radius):
+            vid = village["id"]
+            if village["owner"] != "0" and vid not in extra_farm:
                 if vid not in self.ignored:
                     self.logger.debug(
                         "Ignoring village %s because player owned, add to additional_farms to auto attack", vid
                     )
-                    self.ignored.append(vid)
+                    self.ignored.add(vid)
                 continue
             if my_village and "points" in my_village and "points" in village:
                 if village["points"] >= self.farm_maxpoints:
@@ -191,7 +200,7 @@ class AttackManager:
                             "Ignoring village %s because points %d exceeds limit %d",
                             vid, village["points"], self.farm_maxpoints
                         )
-                        self.ignored.append(vid)
+                        self.ignored.add(vid)
                     continue
                 if village["points"] <= self.farm_minpoints:
                     if vid not in self.ignored:
@@ -199,7 +208,7 @@ class AttackManager:
                             "Ignoring village %s because points %d below limit %d",
                             vid, village["points"], self.farm_minpoints
                         )
-                        self.ignored.append(vid)
+                        self.ignored.add(vid)
                     continue
                 if (
                         village["points"] >= my_village["points"]
@@ -210,7 +219,7 @@ class AttackManager:
                             "Ignoring village %s because of higher points %d -> %d",
                             vid, my_village["points"], village["points"]
                         )
-                        self.ignored.append(vid)
+                        self.ignored.add(vid)
                     continue
                 if vid in self._unknown_ignored:
                     continue
@@ -221,18 +230,9 @@ class AttackManager:
                         "Village %s will be ignored because it is player owned and attack between 23h-8h", vid
                     )
                     continue
-            distance = self.map.get_dist(village["location"])
-            if distance > self.farm_radius:
-                if vid not in self.ignored:
-                    self.logger.debug(
-                        "Village %s will be ignored because it is too far away: distance is %f, max is %d",
-                        vid, distance, self.farm_radius
-                    )
-                    self.ignored.append(vid)
-                continue
             if vid in self.ignored:
                 self.logger.debug("Removed %s from farm ignore list", vid)
-                self.ignored.remove(vid)
+                self.ignored.discard(vid)
 
             output.append([village, distance])
         self.logger.info(
@@ -303,6 +303,8 @@ class AttackManager:
                     )
                     return False
                 if status == 0:
+                    if self.clear_farms and self.plan_clear(vid):
+                        return True
                     if cache_entry["last_attack"] + self.farm_low_prio_wait * 2 > int(time.time()):
                         self.logger.info(f"{vid}: Old scout report found ({cache_entry['last_attack']}), re-scouting")
                         self.scout(vid)
@@ -349,6 +351,27 @@ class AttackManager:
             return False
         return cache_entry
 
+    def plan_clear(self, vid):
+        """
+        Finds the cheapest troops that beat the defence seen in the last scout report
+        """
+        scouted = self.repman.scouted_defence(vid)
+        if not scouted:
+            return False
+        defenders, wall = scouted
+        troops = WorldConstants.get().solver.solve(
+            available={unit: int(amount) for unit, amount in self.troopmanager.troops.items()},
+            defenders=defenders,
+            wall=wall,
+            max_losses=self.clear_max_losses,
+        )
+        if not troops:
+            self.logger.info("%s: defence %s is too strong to clear", vid, str(defenders))
+            return False
+        self.logger.info("%s: clearing defence %s with %s", vid, str(defenders), str(troops))
+        self.clear_troops[vid] = troops
+        return True
+
     def has_troops_available(self, troops):
         for t in troops:
             if (
@@ -419,18 +442,21 @@ class AttackManager:
 
 
 class AttackCache:
+    """
+    Attack state of every farm, kept in memory and written back to the store by flush
+    """
     @staticmethod
     def get_cache(village_id):
-        return FileManager.load_json_file(f"cache/attacks/{village_id}.json")
+        return EntityStore.get().table("attacks").get(village_id)
 
     @staticmethod
     def set_cache(village_id, entry):
-        return FileManager.save_json_file(entry, f"cache/attacks/{village_id}.json")
+        return EntityStore.get().table("attacks").set(village_id, entry)
 
     @staticmethod
     def cache_grab():
-        output = {}
+        return EntityStore.get().table("attacks").all()
 
-        for existing in FileManager.list_directory("cache/attacks", ends_with=".json"):
-            output[existing.replace(".json", "")] = FileManager.load_json_file(f"cache/attacks/{existing}")
-        return output
\ No newline at end of file
+    @staticmethod
+    def flush():
+        return EntityStore.get().table("attacks").flush()
\ No newline at end of file
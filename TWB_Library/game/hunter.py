@@ -1,47 +1,56 @@
+import heapq
+import itertools
+import json
 import time
 import logging
+import threading
 from datetime import datetime
 
+from core.context import AccountContext
 from core.extractors import Extractor
+from core.filemanager import FileManager
+from game.map import Map
 from game.simulator import Simulator
+from game.world import WorldConstants
 
 
 class Hunter:
     game_map = None
-    schedule = {}
     target_villages = {}
     villages = []
     sim = Simulator()
 
     wrapper = None
     targets = {}
-    # start timing 2m before attack start
-    window = 120
+    # Seconds before the local send time of the slowest attack a chain is started
+    activation_lead = 300
+    # Seconds per attack the confirm page is requested before the send moment
+    confirm_lead = 10
+    # Largest accepted difference in seconds between the local travel time and the one the game confirms
+    duration_tolerance = 1
+    # Connections firing the attacks sharing a send time at once, 1 sends them one by one
+    dispatch_concurrency = 4
+    # Milliseconds between the commands of a burst
+    dispatch_gap_ms = 20
+    # Seconds before a burst the connections are opened
+    warm_lead = 1.0
     logger = logging.getLogger("Hunter")
 
-    def nearing_schedule_window(self):
+    def __init__(self):
+        self.schedule = {}
+
+    def longest_travel_time(self, source, attacks):
         """
-        Check if we are near the sending window
-        Now considering that the scheduled time is ARRIVAL time
+        Local travel time of the slowest attack of a chain, None if no target is known to the map
         """
-        current_time = time.time()
-        for arrival_time in self.schedule:
-            # Activate with enough advance time to calculate duration and wait for sending
-            # Maximum attack duration: ~20 minutes (1200s) + 5 minutes margin (300s)
-            activation_window = 1500  # 25 minutes before arrival
-            time_until_arrival = arrival_time - current_time
-            if 0 < time_until_arrival <= activation_window:
-                return arrival_time
-        return None
-
-    def nearing_window_in_sleep(self, sleep):
-        lowest = None
-        for item in self.schedule:
-            wait = time.time() + sleep
-            if item - self.window < wait:
-                if not lowest or item < lowest:
-                    lowest = item
-        return lowest
+        if not self.game_map:
+            return None
+        durations = [
+            self.travel_time(source, self.target_of(attack), attack.get("troops", {}))
+            for attack in attacks
+        ]
+        durations = [duration for duration in durations if duration]
+        return max(durations) if durations else None
 
     def troops_in_village(self, source=None, troops={}):
         if source:
@@ -51,31 +60,50 @@ class Hunter:
             if v.attack.has_troops_available(troops):
                 return v
 
+    def target_of(self, attack):
+        """
+        Village id or coord_x_y target of a scheduled attack
+        """
+        if attack.get("target"):
+            return attack["target"]
+        if attack.get("target_coords"):
+            coords = attack["target_coords"]
+            return f"coord_{coords[0]}_{coords[1]}"
+        return None
+
+    def position_of(self, target):
+        """
+        Location of a village id or coord_x_y target, None if the map does not know it
+        """
+        if isinstance(target, str) and target.startswith("coord_"):
+            _, x_str, y_str = target.split("_")
+            return int(x_str), int(y_str)
+        if target in self.game_map.map_pos:
+            return tuple(self.game_map.map_pos[target])
+        return None
+
+    def travel_time(self, source, target, troops):
+        """
+        Seconds the troops need from the source to the target, computed locally from the map and the world unit speeds
+        """
+        location = self.position_of(target)
+        if not location:
+            return None
+        source_coords = self.game_map.map_pos.get(source, (0, 0))
+        world = WorldConstants.get()
+        # The slowest unit of the group sets the pace, with the real speed of this world
+        return max(1, world.travel_time(world.distance(source_coords, location), troops))
+
     def check_arrival_feasibility(self, source, target, troops, desired_arrival_time):
         """
         Check if it's possible to meet a specific arrival time
         Returns: (feasible, required_send_time, travel_duration)
         """
-        current_time = time.time()
-        
-        # Calculate estimated duration (without preparing the actual attack)
-        if isinstance(target, str) and target.startswith("coord_"):
-            _, x_str, y_str = target.split("_")
-            x, y = int(x_str), int(y_str)
-        elif target in self.game_map.map_pos:
-            x, y = self.game_map.map_pos[target]
-        else:
+        current_time = self.now()
+        estimated_duration = self.travel_time(source, target, troops)
+        if estimated_duration is None:
             return False, 0, 0
         
-        # Rough estimate based on distance and troop type
-        # (can be refined with more precise calculations)
-        source_coords = self.game_map.map_pos.get(source, (0, 0))
-        distance = ((x - source_coords[0])**2 + (y - source_coords[1])**2)**0.5
-        
-        # Estimated speed based on slowest troop
-        speed_per_minute = 10  # Conservative estimate
-        estimated_duration = max(60, distance * 60 / speed_per_minute)  # Minimum 1 minute
-        
         required_send_time = desired_arrival_time - estimated_duration
         
         # Check feasibility
@@ -87,7 +115,7 @@ class Hunter:
         """
         Suggest the earliest possible arrival time
         """
-        current_time = time.time()
+        current_time = self.now()
         _, _, estimated_duration = self.check_arrival_feasibility(source, target, troops, current_time + 3600)
         
         # Add safety margin
@@ -95,16 +123,52 @@ class Hunter:
         
         return earliest_arrival
 
+    def log_impossible(self, exact_arrival_time, send_time, duration):
+        current_time = self.now()
+        self.logger.error("IMPOSSIBLE TO MEET ARRIVAL TIME!")
+        self.logger.error("   • Desired arrival: %s", datetime.fromtimestamp(exact_arrival_time).strftime('%H:%M:%S'))
+        self.logger.error("   • Required send time: %s (already passed!)", datetime.fromtimestamp(send_time).strftime('%H:%M:%S'))
+        self.logger.error("   • Now: %s", datetime.fromtimestamp(current_time).strftime('%H:%M:%S'))
+        # +30s margin
+        self.logger.error("   • Earliest possible arrival: %s",
+                          datetime.fromtimestamp(current_time + duration + 30).strftime('%H:%M:%S'))
+
+    def now(self):
+        """
+        Current time on the game clock, the local clock when no wrapper is attached
+        """
+        return self.wrapper.clock.server_time() if self.wrapper else time.time()
+
+    def wait_until(self, moment):
+        """
+        Sleeps until a moment on the game clock, logging progress during long waits
+        Returns how late the wait ended in seconds
+        """
+        wait_time = moment - self.now()
+        if wait_time <= 0:
+            return 0.0
+        if wait_time > 1:
+            self.logger.info("Waiting %.1f minutes until send...", wait_time/60)
+        last_update = [time.monotonic()]
+
+        def progress(remaining):
+            # Update every 30 seconds
+            if time.monotonic() - last_update[0] > 30:
+                self.logger.info("Still waiting... %.1f minutes remaining", remaining/60)
+                last_update[0] = time.monotonic()
+
+        return self.wrapper.clock.sleep_until(moment, progress=progress)
+
     def send_attack_chain(self, source, item, exact_arrival_time=0, min_sleep_amount_millis=100):
         """
         Execute a chain of scheduled attacks
         item = desired ARRIVAL time
+        Send times are computed locally, the confirm pages of each send time group are requested right before it goes out
         """
         data = self.schedule[item]
-        attack_set = []
         
         # Preliminary feasibility check - only block if arrival has already passed
-        current_time = time.time()
+        current_time = self.now()
         
         if exact_arrival_time <= current_time:
             arrival_dt = datetime.fromtimestamp(exact_arrival_time)
@@ -115,148 +179,197 @@ class Hunter:
             self.logger.error("   • Now: %s", current_dt.strftime('%H:%M:%S'))
             return False
         
-        self.logger.info("Preparing %d attacks for arrival at %s" % (len(data), datetime.fromtimestamp(exact_arrival_time).strftime('%H:%M:%S')))
+        self.logger.info("Planning %d attacks for arrival at %s" % (len(data), datetime.fromtimestamp(exact_arrival_time).strftime('%H:%M:%S')))
         
-        # Calculate send time based on duration
-        send_times = []
+        # Calculate send time based on the local travel time, no requests needed
+        plans = []
         
         for attack in data:
-            # Determine target
-            target = None
-            if attack.get("target"):
-                target = attack["target"]
-            elif attack.get("target_coords"):
-                # Convert coordinates to village_id if necessary
-                coords = attack["target_coords"]
-                target = f"coord_{coords[0]}_{coords[1]}"
-            
+            target = self.target_of(attack)
             if not target:
                 self.logger.error("Target not found for attack: %s", attack.get("id", "no_id"))
                 continue
             
-            # Prepare attack and get duration
-            attack_type = attack.get("type", "attack")
-            result = self.attack(source, target, troops=attack.get("troops", {}), attack_type=attack_type)
+            duration = self.travel_time(source, target, attack.get("troops", {}))
+            if duration is None:
+                self.logger.error("Target coordinates not found: %s", target)
+                continue
             
-            if result:
-                if isinstance(result, tuple):
-                    # If returned tuple (data, duration)
-                    attack_data, duration = result
-                    
-                    # Calculate send time: arrival - duration
-                    send_time = exact_arrival_time - duration
-                    current_time = time.time()
-                    
-                    # Check if it's still possible to send at the right time
-                    if send_time <= current_time:
-                        send_dt = datetime.fromtimestamp(send_time)
-                        current_dt = datetime.fromtimestamp(current_time)
-                        arrival_dt = datetime.fromtimestamp(exact_arrival_time)
-                        
-                        # Calculate new possible arrival time
-                        earliest_arrival = current_time + duration + 30  # +30s margin
-                        earliest_arrival_dt = datetime.fromtimestamp(earliest_arrival)
-                        
-                        self.logger.error("IMPOSSIBLE TO MEET ARRIVAL TIME!")
-                        self.logger.error("   • Desired arrival: %s", arrival_dt.strftime('%H:%M:%S'))
-                        self.logger.error("   • Required send time: %s (already passed!)", send_dt.strftime('%H:%M:%S'))
-                        self.logger.error("   • Now: %s", current_dt.strftime('%H:%M:%S'))
-                        self.logger.error("   • Earliest possible arrival: %s", earliest_arrival_dt.strftime('%H:%M:%S'))
-                        
-                        return False
-                    
-                    send_times.append(send_time)
-                    
-                    attack_set.append(attack_data)
-                    
-                    arrival_dt = datetime.fromtimestamp(exact_arrival_time)
-                    send_dt = datetime.fromtimestamp(send_time)
-                    
-                    self.logger.info("Attack %s: send %s → arrival %s (duration: %ds)", 
-                                   attack.get("id", "no_id"),
-                                   send_dt.strftime('%H:%M:%S'),
-                                   arrival_dt.strftime('%H:%M:%S'),
-                                   duration)
-                else:
-                    # If returned only data
-                    attack_set.append(result)
-                    send_times.append(exact_arrival_time)  # Fallback
-                    self.logger.debug("Attack prepared: %s", attack.get("id", "no_id"))
-            else:
-                self.logger.error("Failed to prepare attack: %s", attack.get("id", "no_id"))
+            # Calculate send time: arrival - duration
+            send_time = exact_arrival_time - duration
+            
+            # Check if it's still possible to send at the right time
+            if send_time <= self.now():
+                self.log_impossible(exact_arrival_time, send_time, duration)
+                return False
+            
+            plans.append((attack, target, duration))
+            
+            self.logger.info("Attack %s: send %s → arrival %s (duration: %ds)", 
+                           attack.get("id", "no_id"),
+                           datetime.fromtimestamp(send_time).strftime('%H:%M:%S'),
+                           datetime.fromtimestamp(exact_arrival_time).strftime('%H:%M:%S'),
+                           duration)
         
-        if not attack_set:
-            self.logger.error("No attacks were prepared successfully")
-            # Disable priority mode
-            self.wrapper.priority_mode = False
+        if not plans:
+            self.logger.error("No attacks could be planned")
             return False
         
         # Use the smallest send time (in case of multiple attacks)
-        exact_send_time = min(send_times) if send_times else exact_arrival_time
+        exact_send_time = exact_arrival_time - max(duration for _, _, duration in plans)
         
         # Log calculated schedule
-        current_time = time.time()
-        send_dt = datetime.fromtimestamp(exact_send_time)
-        arrival_dt = datetime.fromtimestamp(exact_arrival_time)
-        current_dt = datetime.fromtimestamp(current_time)
-        wait_time = exact_send_time - current_time
-        
+        current_time = self.now()
         self.logger.info("CALCULATED SCHEDULE:")
-        self.logger.info(" • Now: %s", current_dt.strftime('%H:%M:%S'))
-        self.logger.info(" • Send: %s (in %.1f minutes)", send_dt.strftime('%H:%M:%S'), wait_time/60)
-        self.logger.info(" • Arrival: %s", arrival_dt.strftime('%H:%M:%S'))
-        
-        # Activate priority mode
-        self.wrapper.priority_mode = True
+        self.logger.info(" • Now: %s", datetime.fromtimestamp(current_time).strftime('%H:%M:%S'))
+        self.logger.info(" • Send: %s (in %.1f minutes)", datetime.fromtimestamp(exact_send_time).strftime('%H:%M:%S'), (exact_send_time - current_time)/60)
+        self.logger.info(" • Arrival: %s", datetime.fromtimestamp(exact_arrival_time).strftime('%H:%M:%S'))
         
-        # Wait for exact SEND moment
-        if wait_time > 0:
-            self.logger.info("Waiting %.1f minutes until send...", wait_time/60)
-            
-            # For long waits (>1 minute), show progress
-            if wait_time > 60:
-                last_update = 0
-                while time.time() < exact_send_time:
-                    time.sleep(1)
-                    remaining = exact_send_time - time.time()
-                    # Update every 30 seconds
-                    if time.time() - last_update > 30:
-                        self.logger.info("Still waiting... %.1f minutes remaining", remaining/60)
-                        last_update = time.time()
+        return self.confirm_and_send(source, plans, exact_arrival_time, min_sleep_amount_millis)
+
+    def confirm_batches(self, plans, exact_arrival_time):
+        """
+        Splits the plans into batches of send time groups, earliest send first
+        A group whose confirms would overlap the send of the group before it is confirmed together with that group
+        """
+        batches = []
+        last_send = None
+        ordered = sorted(plans, key=lambda plan: -plan[2])
+        for send_time, group in itertools.groupby(ordered, key=lambda plan: exact_arrival_time - plan[2]):
+            group = list(group)
+            if batches and send_time - self.confirm_lead * len(group) < last_send:
+                batches[-1].extend(group)
             else:
-                # For short waits, just wait
-                while time.time() < exact_send_time:
-                    time.sleep(0.1)
-        
-        self.logger.info("SENDING ATTACKS NOW!")
-        
-        # Execute attacks
+                batches.append(group)
+            last_send = send_time
+        return batches
+
+    def confirm_and_send(self, source, plans, exact_arrival_time, min_sleep_amount_millis=100):
+        """
+        Confirms and sends the planned attacks one send time group at a time
+        Each group is confirmed confirm_lead seconds per attack before its own send time
+        Other threads are only held during each confirm and each send, never while waiting for a send time
+        """
+        clock = self.wrapper.clock
         start_time = datetime.now()
+        prepared = 0
         successful_attacks = 0
-        
-        for prepared_attack in attack_set:
-            time.sleep(min_sleep_amount_millis / 1000.0)  # Convert ms to seconds
-            result = self.send_attack(source, prepared_attack)
-            if result:
-                self.logger.info("Attack sent successfully!")
-                successful_attacks += 1
+        for batch in self.confirm_batches(plans, exact_arrival_time):
+            first_send = exact_arrival_time - max(duration for _, _, duration in batch)
+            self.wait_until(first_send - self.confirm_lead * len(batch))
+            ordered = self.confirm(source, batch, exact_arrival_time)
+            if not ordered:
+                continue
+            prepared += len(ordered)
+
+            self.logger.info("Server clock: %s", clock.describe())
+            # Every attack is dispatched half a round trip before its send time, so it reaches the server on time
+            one_way = (clock.rtt or 0) / 2
+            self.logger.info("SENDING %d ATTACKS", len(ordered))
+            if self.dispatch_concurrency > 1:
+                successful_attacks += self.dispatch_bursts(source, ordered, one_way)
             else:
-                self.logger.error("Failed to send attack!")
-        
-        end_time = datetime.now()
-        duration_ms = (end_time - start_time).total_seconds() * 1000
-        
+                successful_attacks += self.send_serial(source, ordered, one_way, min_sleep_amount_millis)
+
+        if not prepared:
+            self.logger.error("No attacks were prepared successfully")
+            return False
+
+        duration_ms = (datetime.now() - start_time).total_seconds() * 1000
         if successful_attacks > 0:
             self.logger.info("Sent %d attacks in %.0f milliseconds" % (successful_attacks, duration_ms))
-            # Disable priority mode
-            self.wrapper.priority_mode = False
             return True
         else:
             self.logger.error("No attacks were sent successfully!")
-            # Disable priority mode
-            self.wrapper.priority_mode = False
             return False
 
+    def confirm(self, source, plans, exact_arrival_time):
+        """
+        Requests the confirm page of every plan, a travel time confirmed by the game replaces the local one
+        Returns (send time, confirm data) pairs ordered by send time
+        """
+        ordered = []
+        for attack, target, duration in plans:
+            with self.wrapper.scheduler.critical():
+                result = self.attack(source, target, troops=attack.get("troops", {}), attack_type=attack.get("type", "attack"))
+            if not result:
+                self.logger.error("Failed to prepare attack: %s", attack.get("id", "no_id"))
+                continue
+            attack_data, confirmed = result
+            if confirmed and abs(confirmed - duration) > self.duration_tolerance:
+                # The game has the final word, the local numbers are off for this world
+                self.logger.warning("Attack %s: game travel time %ds differs from the local estimate %ds",
+                                    attack.get("id", "no_id"), confirmed, duration)
+                duration = confirmed
+            send_time = exact_arrival_time - duration
+            if send_time <= self.now():
+                self.log_impossible(exact_arrival_time, send_time, duration)
+                continue
+            ordered.append((send_time, attack_data))
+        return sorted(ordered, key=lambda x: x[0])
+
+    def send_serial(self, source, ordered, one_way, min_sleep_amount_millis=100):
+        """
+        Sends (send time, confirm data) pairs one by one, at least min_sleep_amount_millis apart
+        """
+        clock = self.wrapper.clock
+        successful_attacks = 0
+        last_dispatch = None
+        for send_time, prepared_attack in ordered:
+            dispatch = send_time - one_way
+            if last_dispatch is not None:
+                dispatch = max(dispatch, last_dispatch + min_sleep_amount_millis / 1000.0)
+            late = self.wait_until(dispatch)
+            with self.wrapper.scheduler.critical():
+                last_dispatch = self.now()
+                result = self.send_attack(source, prepared_attack)
+            error = self.command_error(result)
+            if error:
+                self.logger.error("Failed to send attack: %s", error)
+            else:
+                # Where the attack lands compared to the planned arrival, as far as the clock estimate can tell
+                landing = (last_dispatch + one_way) - send_time
+                self.logger.info("Attack sent successfully! Landing %+.1f ms from the planned arrival (woke %.2f ms late, clock ±%.0f ms)",
+                                 landing * 1000, late * 1000, (clock.uncertainty or 0) * 1000)
+                successful_attacks += 1
+        return successful_attacks
+
+    def dispatch_bursts(self, source, ordered, one_way):
+        """
+        Fires the attacks that share a send time together over warmed connections, dispatch_gap_ms apart
+        Returns how many attacks were accepted
+        """
+        clock = self.wrapper.clock
+        successful_attacks = 0
+        for send_time, group in itertools.groupby(ordered, key=lambda x: x[0]):
+            payloads = [
+                self.wrapper.prepare_api_action(source, "popup_command", params={"screen": "place"}, data=data)
+                for _, data in group
+            ]
+            dispatch = send_time - one_way
+            self.wait_until(dispatch - self.warm_lead)
+            concurrency = min(self.dispatch_concurrency, len(payloads))
+            self.wrapper.warm_pool(concurrency)
+            at = clock.to_monotonic(dispatch)
+            results = self.wrapper.dispatch(
+                payloads, at=at, gap=self.dispatch_gap_ms / 1000.0, concurrency=concurrency
+            )
+            moments = [sent for _, sent in results]
+            accepted = 0
+            for res, _ in results:
+                error = self.command_error(self.response_body(res))
+                if error:
+                    self.logger.error("Attack of the burst was refused: %s", error)
+                else:
+                    accepted += 1
+            successful_attacks += accepted
+            self.logger.info(
+                "Dispatched %d/%d attacks within %.1f ms, first one %+.1f ms from the planned send (clock ±%.0f ms)",
+                accepted, len(results), (max(moments) - min(moments)) * 1000, (min(moments) - at) * 1000,
+                (clock.uncertainty or 0) * 1000
+            )
+        return successful_attacks
+
     def attack(self, source, target, troops=None, attack_type="attack"):
         """
         Prepare an attack for sending
@@ -384,6 +497,33 @@ class Hunter:
             self.logger.error("Error preparing attack: %s", str(e))
             return False
 
+    @staticmethod
+    def response_body(res):
+        """
+        The decoded answer to a command, None when there was no usable answer
+        """
+        if res is None or res.status_code != 200:
+            return None
+        try:
+            return res.json()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def command_error(result):
+        """
+        Why the game refused a command, None if it was accepted
+        The game answers a refused command with an error entry, anything but JSON means it never got through
+        """
+        if result is None:
+            return "no response"
+        if not isinstance(result, dict):
+            return "unexpected response"
+        error = result.get("error")
+        if error:
+            return ", ".join(error) if isinstance(error, list) else str(error)
+        return None
+
     def send_attack(self, source, data):
         return self.wrapper.get_api_action(
             village_id=source,
@@ -452,4 +592,290 @@ class Hunter:
             data=confirm_data,
         )
 
-        return result
\ No newline at end of file
+        return result
+
+
+class HunterSchedule:
+    """
+    Scheduled attack chains of the account in one min-heap per source village, ordered by send time
+    Outcomes are appended to a journal instead of rewriting the schedule file, which is compacted now and then
+    """
+    path = "cache/hunter/scheduled_attacks.json"
+    journal_path = "cache/hunter/schedule_journal.jsonl"
+    # Journal entries after which the outcomes are written into the schedule file
+    compact_every = 50
+    # Travel time assumed when the map does not know a target yet
+    unknown_duration = 1200
+    done = ("executed", "failed")
+    logger = logging.getLogger("HunterSchedule")
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.heaps = {}
+        self.mtime = None
+        self.journal_entries = 0
+        self.estimate = None
+        # (source, key) of the chains queued with unknown_duration, estimated again until the map knows their targets
+        self.guessed = set()
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the schedule of the current account
+        """
+        key = FileManager.get_root()
+        with cls._instances_lock:
+            schedule = cls._instances.get(key)
+            if not schedule:
+                schedule = cls()
+                cls._instances[key] = schedule
+            return schedule
+
+    def snapshot_mtime(self):
+        try:
+            return FileManager.get_path(self.path).stat().st_mtime
+        except OSError:
+            return None
+
+    def read_journal(self):
+        """
+        Outcomes recorded since the last compaction, keyed by (arrival key, source, attack id)
+        """
+        outcomes = {}
+        self.journal_entries = 0
+        try:
+            with open(FileManager.get_path(self.journal_path), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    outcomes[(entry["key"], entry["source"], entry["id"])] = entry
+                    self.journal_entries += 1
+        except OSError:
+            pass
+        return outcomes
+
+    def refresh(self, estimate=None, now=None):
+        """
+        Reloads the schedule when the file changed and replays the journal on top of it
+        estimate(source, attacks) gives the travel time of the slowest attack of a chain
+        """
+        with self.lock:
+            self.estimate = estimate or self.estimate
+            mtime = self.snapshot_mtime()
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            self.data = (FileManager.load_json_file(self.path) or {}) if mtime else {}
+            outcomes = self.read_journal()
+            now = now or time.time()
+            self.heaps = {}
+            self.guessed = set()
+            for key, attacks in self.data.get("hunter_schedule", {}).items():
+                arrival = float(key)
+                sources = {}
+                for attack in attacks:
+                    source = str(attack.get("source"))
+                    outcome = outcomes.get((key, source, attack.get("id")))
+                    if outcome:
+                        attack["status"] = outcome["status"]
+                        attack["executed_at"] = outcome["time"]
+                    if attack.get("status") not in self.done:
+                        sources.setdefault(source, []).append(attack)
+                if arrival <= now:
+                    continue
+                for source, group in sources.items():
+                    duration = self.estimate(source, group) if self.estimate else None
+                    if not duration:
+                        duration = self.unknown_duration
+                        self.guessed.add((source, key))
+                    self.heaps.setdefault(source, []).append((arrival - duration, arrival, key))
+            for heap in self.heaps.values():
+                heapq.heapify(heap)
+            return True
+
+    def reestimate(self):
+        """
+        Moves the chains queued with unknown_duration to their real send time once the map knows their targets
+        """
+        with self.lock:
+            if not self.guessed or not self.estimate:
+                return
+            for source, key in list(self.guessed):
+                heap = self.heaps.get(source, [])
+                entry = next((entry for entry in heap if entry[2] == key), None)
+                if not entry:
+                    self.guessed.discard((source, key))
+                    continue
+                duration = self.estimate(source, self.pending(key, source))
+                if not duration:
+                    continue
+                heap.remove(entry)
+                heap.append((entry[1] - duration, entry[1], key))
+                heapq.heapify(heap)
+                self.guessed.discard((source, key))
+
+    def peek(self, source=None):
+        """
+        (send time, arrival, key) of the next chain of a source or of the whole account
+        """
+        with self.lock:
+            self.reestimate()
+            heaps = [self.heaps.get(str(source), [])] if source else self.heaps.values()
+            entries = [heap[0] for heap in heaps if heap]
+            return min(entries) if entries else None
+
+    def pop_due(self, moment, source=None):
+        """
+        Removes and returns the chains that have to be sent before a moment, as (send time, arrival, source, key)
+        """
+        due = []
+        with self.lock:
+            self.reestimate()
+            sources = [str(source)] if source else list(self.heaps)
+            for name in sources:
+                heap = self.heaps.get(name, [])
+                while heap and heap[0][0] <= moment:
+                    send_time, arrival, key = heapq.heappop(heap)
+                    due.append((send_time, arrival, name, key))
+        return sorted(due)
+
+    def push(self, send_time, arrival, source, key):
+        """
+        Puts a chain back, for example when it could not be started yet
+        """
+        with self.lock:
+            heapq.heappush(self.heaps.setdefault(str(source), []), (send_time, arrival, key))
+
+    def pending(self, key, source):
+        """
+        The attacks of a chain that did not run yet
+        """
+        with self.lock:
+            return [
+                attack for attack in self.data.get("hunter_schedule", {}).get(key, [])
+                if str(attack.get("source")) == str(source) and attack.get("status") not in self.done
+            ]
+
+    def mark(self, key, source, attacks, status):
+        """
+        Records the outcome of attacks in the journal
+        """
+        executed_at = datetime.now().isoformat()
+        lines = []
+        with self.lock:
+            for attack in attacks:
+                attack["status"] = status
+                attack["executed_at"] = executed_at
+                lines.append(json.dumps({
+                    "key": key, "source": str(source), "id": attack.get("id"), "status": status, "time": executed_at
+                }))
+            path = FileManager.get_path(self.journal_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self.journal_entries += len(lines)
+            if self.journal_entries >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """
+        Writes the outcomes into the schedule file and shortens the journal
+        Outcomes of chains that did not arrive yet stay in the journal, the web interface may still rewrite the file
+        without them
+        """
+        with self.lock:
+            if self.snapshot_mtime() != self.mtime:
+                self.mtime = None
+                self.refresh()
+            if not self.data:
+                return
+            FileManager.save_json_file(self.data, self.path)
+            self.mtime = self.snapshot_mtime()
+            now = time.time()
+            live = [entry for entry in self.read_journal().values() if float(entry["key"]) > now]
+            with open(FileManager.get_path(self.journal_path), "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in live)
+            self.journal_entries = len(live)
+
+
+class HunterDaemon(threading.Thread):
+    """
+    Runs the scheduled attacks on a thread of its own, so the village cycle and its sleeps can not delay them
+    Every due chain gets a worker of its own, chains only wait for each other inside the critical blocks of the wrapper
+    """
+    # Seconds between checks of the schedule file
+    poll_interval = 30
+    logger = logging.getLogger("HunterDaemon")
+
+    def __init__(self, wrapper):
+        super().__init__(name="HunterDaemon", daemon=True)
+        self.wrapper = wrapper
+        # The account context is thread-local, the thread continues in the one of its creator
+        self.account_path = AccountContext.get_account_path() if AccountContext.is_multi_account_mode() else None
+        self.stop_event = threading.Event()
+        self.hunter = Hunter()
+        self.hunter.wrapper = wrapper
+        self.schedule = None
+        self.workers = []
+
+    def stop(self):
+        self.stop_event.set()
+
+    def execute(self, arrival, source, key):
+        """
+        Runs one chain and records its outcome
+        """
+        attacks = self.schedule.pending(key, source)
+        if not attacks:
+            return
+        hunter = Hunter()
+        hunter.wrapper = self.wrapper
+        hunter.game_map = self.hunter.game_map
+        hunter.schedule = {arrival: attacks}
+        success = hunter.send_attack_chain(source=source, item=arrival, exact_arrival_time=arrival)
+        self.schedule.mark(key, source, attacks, "executed" if success else "failed")
+
+    def start_chain(self, arrival, source, key):
+        """
+        Runs a chain on a worker of its own, so waiting for its send time does not hold back the other chains
+        """
+        def work():
+            if self.account_path:
+                AccountContext.set_account_path(self.account_path)
+            try:
+                self.execute(arrival, source, key)
+            except Exception as e:
+                self.logger.error("Hunter chain %s of village %s failed: %s", key, source, str(e))
+
+        worker = threading.Thread(target=work, name="HunterChain-%s-%s" % (source, key), daemon=True)
+        self.workers = [running for running in self.workers if running.is_alive()] + [worker]
+        worker.start()
+
+    def run(self):
+        if self.account_path:
+            AccountContext.set_account_path(self.account_path)
+        self.hunter.game_map = Map(wrapper=self.wrapper)
+        self.schedule = HunterSchedule.get()
+        self.logger.info("Hunter daemon started")
+        while not self.stop_event.is_set():
+            try:
+                if self.schedule.refresh(self.hunter.longest_travel_time, now=self.hunter.now()):
+                    entry = self.schedule.peek()
+                    if entry:
+                        self.logger.info("Hunter schedule loaded, next send at %s",
+                                         datetime.fromtimestamp(entry[0]).strftime('%H:%M:%S'))
+                for _, arrival, source, key in self.schedule.pop_due(self.hunter.now() + self.hunter.activation_lead):
+                    self.start_chain(arrival, source, key)
+            except Exception as e:
+                self.logger.error("Hunter daemon error: %s", str(e))
+            timeout = self.poll_interval
+            entry = self.schedule.peek() if self.schedule else None
+            if entry:
+                timeout = min(timeout, max(0.0, entry[0] - self.hunter.activation_lead - self.hunter.now()))
+            self.stop_event.wait(timeout)
@@ -3,114 +3,221 @@ Map management, pls don't read this code.
 """
 import logging
 import math
+import threading
 import time
 
 from core.extractors import Extractor
 from core.filemanager import FileManager
+from core.store import EntityStore
 
 
-class Map:
+class WorldMap:
     """
-    Class to manage the world around you
+    Account-wide picture of the world, every map sector is fetched once and shared by all own villages
     """
-    wrapper = None
-    village_id = None
-    map_data = []
-    villages = {}
-    my_location = None
-    map_pos = {}
-    last_fetch = 0
+    sector_size = 20
+    # Size of the buckets of the spatial index used for radius queries
+    cell_size = 10
     fetch_delay = 8
+    # Villages further than this from every own village are only kept in the store
+    keep_radius = None
+    logger = logging.getLogger("WorldMap")
 
-    def __init__(self, wrapper=None, village_id=None):
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, wrapper=None):
+        self.wrapper = wrapper
+        self.villages = {}
+        self.map_pos = {}
+        # Sector origin -> time it was last fetched and the villages that were in it
+        self.sectors = {}
+        self.sector_villages = {}
+        self.own_locations = {}
+        self.grid = {}
+
+    @classmethod
+    def get(cls, wrapper):
         """
-        Creates the map files
+        Returns the world map of the current account
         """
-        self.wrapper = wrapper
-        self.village_id = village_id
+        key = FileManager.get_root()
+        with cls._instances_lock:
+            world = cls._instances.get(key)
+            if not world:
+                world = cls(wrapper=wrapper)
+                cls._instances[key] = world
+            world.wrapper = wrapper
+            return world
 
-    def get_map(self):
+    def trim(self, radius=None):
         """
-        Fetch the map every 24ish hours and update the cache entries
+        Forgets villages that are too far from every own village to matter, returns how many were dropped
         """
-        if self.last_fetch + (self.fetch_delay * 3600) > time.time():
-            return
-        self.last_fetch = time.time()
-        res = self.wrapper.get_action(village_id=self.village_id, action="map")
-        game_state = Extractor.game_state(res)
-        self.map_data = Extractor.map_data(res)
-        if self.map_data:
-            for tile in self.map_data:
-                data = tile["data"]
-                x = int(data["x"])
-                y = int(data["y"])
-                vdata = data["villages"]
-                # Fix broken parsing                 
-                if type(vdata) is dict:
-                    cdata = [{}] * 20
-                    for k, v in vdata.items():
-                        if type(v) is not dict:
-                            cdata[int(k)] = {0: item[0:] for item in v}
-                        else:
-                            cdata[int(k)] = v
-                    vdata = cdata
-                for lon, val in enumerate(vdata):
-                    if not val:
-                        continue
-                    # Force dict type to iterate properly
-                    if type(val) != dict:
-                        val = {i: val[i] for i in range(0, len(val))}
-                    for lat, entry in val.items():
-                        if not lat:
-                            continue
-                        coords = [x + int(lon), y + int(lat)]
-                        if entry[0] == str(self.village_id):
-                            self.my_location = coords
-
-                        self.build_cache_entry(location=coords, entry=entry)
-                if not self.my_location:
-                    self.my_location = [
-                        game_state["village"]["x"],
-                        game_state["village"]["y"],
-                    ]
-        if not self.map_data or not self.villages:
-            return self.get_map_old(game_state=game_state)
+        radius = radius or self.keep_radius
+        own = list(self.own_locations.values())
+        if not radius or not own:
+            return 0
+        keep = set()
+        for location in own:
+            keep.update(village["id"] for village, _ in self.in_radius(location, radius))
+        keep.update(self.own_locations)
+        dropped = [vid for vid in self.villages if vid not in keep]
+        for vid in dropped:
+            self.unindex(vid)
+            self.villages.pop(vid, None)
+            self.map_pos.pop(vid, None)
+        for found in self.sector_villages.values():
+            found.difference_update(dropped)
+        return len(dropped)
+
+    def position(self, vid):
+        """
+        Location of any known village, also the ones that were trimmed from memory
+        """
+        vid = str(vid)
+        if vid in self.map_pos:
+            return self.map_pos[vid]
+        entry = MapCache.get_cache(village_id=vid)
+        return entry["location"] if entry else None
+
+    def sector_of(self, location):
+        """
+        Origin of the sector a coordinate is in
+        """
+        return (
+            int(location[0]) // self.sector_size * self.sector_size,
+            int(location[1]) // self.sector_size * self.sector_size,
+        )
+
+    def covered(self, location):
+        """
+        True if the sector of a location and the ones around it were fetched recently
+        """
+        if not location:
+            return False
+        sx, sy = self.sector_of(location)
+        oldest = time.time() - self.fetch_delay * 3600
+        for dx in (-self.sector_size, 0, self.sector_size):
+            for dy in (-self.sector_size, 0, self.sector_size):
+                if self.sectors.get((sx + dx, sy + dy), 0) < oldest:
+                    return False
         return True
 
-    def get_map_old(self, game_state):
+    def mark_fetched(self, location, moment=None):
         """
-        Old method of parsing the map, might work, might not, who knows
+        Marks the sector of a location and the ones around it as fetched
+        """
+        if not location:
+            return
+        sx, sy = self.sector_of(location)
+        moment = moment or time.time()
+        for dx in (-self.sector_size, 0, self.sector_size):
+            for dy in (-self.sector_size, 0, self.sector_size):
+                self.sectors[(sx + dx, sy + dy)] = max(self.sectors.get((sx + dx, sy + dy), 0), moment)
+
+    def location_of(self, village_id):
+        """
+        Location of an own village if it is known
+        """
+        return self.own_locations.get(str(village_id)) or self.map_pos.get(str(village_id))
+
+    def refresh(self, village_id):
         """
-        if self.map_data:
-            for tile in self.map_data:
-                data = tile["data"]
-                x = int(data["x"])
-                y = int(data["y"])
-                vdata = data["villages"]
-                for lon, lon_val in enumerate(vdata):
-                    try:
-                        for lat in vdata[lon]:
-                            coords = [x + int(lon), y + int(lat)]
-                            entry = vdata[lon][lat]
-                            if entry[0] == str(self.village_id):
-                                self.my_location = coords
-
-                            self.build_cache_entry(location=coords, entry=entry)
-                    except:
-                        raise
-            if not self.my_location:
-                self.my_location = [
-                    game_state["village"]["x"],
-                    game_state["village"]["y"],
-                ]
-        if not self.map_data or not self.villages:
+        Makes sure the area around an own village is known, only fetching the map page when it is not
+        """
+        village_id = str(village_id)
+        if self.covered(self.location_of(village_id)):
+            return True
+        res = self.wrapper.get_action(village_id=village_id, action="map")
+        game_state = Extractor.game_state(res)
+        map_data = Extractor.map_data(res)
+        if map_data:
+            snapshot = self.merge(map_data, self.parse_sectors)
+            if not snapshot:
+                snapshot = self.merge(map_data, self.parse_sectors_old)
+            MapCache.update(snapshot)
+        if village_id in self.map_pos:
+            self.own_locations[village_id] = self.map_pos[village_id]
+        elif game_state:
+            self.own_locations[village_id] = [game_state["village"]["x"], game_state["village"]["y"]]
+        if map_data:
+            # Empty sectors and the ones the page left out count as fetched as well
+            self.mark_fetched(self.location_of(village_id))
+        if not map_data or not self.villages:
             logging.warning(
-                "Error reading map state for village %s, farming might not work properly",
-                self.village_id
+                "Error reading map state for village %s, farming might not work properly", village_id
             )
             return False
         return True
 
+    def merge(self, map_data, parser):
+        """
+        Replaces the contents of every fetched sector, villages that vanished from a sector are dropped
+        """
+        snapshot = {}
+        fetched = {}
+        for tile in map_data:
+            data = tile["data"]
+            origin = self.sector_of((data["x"], data["y"]))
+            found = fetched.setdefault(origin, set())
+            for location, entry in parser(data):
+                structure = self.build_cache_entry(location=location, entry=entry)
+                if structure:
+                    snapshot[structure["id"]] = structure
+                    found.add(structure["id"])
+        if not snapshot:
+            return snapshot
+        now = time.time()
+        for origin, found in fetched.items():
+            for vid in self.sector_villages.get(origin, set()) - found:
+                self.unindex(vid)
+                self.villages.pop(vid, None)
+                self.map_pos.pop(vid, None)
+            self.sector_villages[origin] = found
+            self.sectors[origin] = now
+        return snapshot
+
+    @staticmethod
+    def parse_sectors(data):
+        """
+        Yields (location, entry) for every village in a sector
+        """
+        x = int(data["x"])
+        y = int(data["y"])
+        vdata = data["villages"]
+        # Fix broken parsing
+        if type(vdata) is dict:
+            cdata = [{}] * 20
+            for k, v in vdata.items():
+                if type(v) is not dict:
+                    cdata[int(k)] = {0: item[0:] for item in v}
+                else:
+                    cdata[int(k)] = v
+            vdata = cdata
+        for lon, val in enumerate(vdata):
+            if not val:
+                continue
+            # Force dict type to iterate properly
+            if type(val) != dict:
+                val = {i: val[i] for i in range(0, len(val))}
+            for lat, entry in val.items():
+                if not lat:
+                    continue
+                yield [x + int(lon), y + int(lat)], entry
+
+    @staticmethod
+    def parse_sectors_old(data):
+        """
+        Old method of parsing the map, might work, might not, who knows
+        """
+        x = int(data["x"])
+        y = int(data["y"])
+        vdata = data["villages"]
+        for lon, lon_val in enumerate(vdata):
+            for lat in vdata[lon]:
+                yield [x + int(lon), y + int(lat)], vdata[lon][lat]
+
     def build_cache_entry(self, location, entry):
         """
         Builds a cache entry based on their weird data structure
@@ -121,7 +228,7 @@ class Map:
             points = int(entry[3].replace(".", ""))
         except ValueError:
             # Breaks farming logic on event villages
-            return
+            return None
         player = entry[4]
         bonus = entry[6]
         clan = entry[11]
@@ -138,13 +245,88 @@ class Map:
             "buildings": {},
             "resources": {},
         }
+        self.index(vid, location)
         self.map_pos[vid] = location
-        cached = self.in_cache(vid)
-        if not cached:
-            MapCache.set_cache(village_id=vid, entry=structure)
-        if cached and cached != structure:
-            MapCache.set_cache(village_id=vid, entry=structure)
         self.villages[vid] = structure
+        return structure
+
+    def cell_of(self, location):
+        """
+        Grid cell a coordinate belongs to
+        """
+        return int(location[0]) // self.cell_size, int(location[1]) // self.cell_size
+
+    def index(self, vid, location):
+        """
+        Puts a village in the spatial index, moving it if its location changed
+        """
+        if vid in self.map_pos:
+            if self.map_pos[vid] == location:
+                return
+            self.unindex(vid)
+        self.grid.setdefault(self.cell_of(location), set()).add(vid)
+
+    def unindex(self, vid):
+        """
+        Removes a village from the spatial index
+        """
+        if vid not in self.map_pos:
+            return
+        cell = self.cell_of(self.map_pos[vid])
+        bucket = self.grid.get(cell)
+        if bucket:
+            bucket.discard(vid)
+            if not bucket:
+                del self.grid[cell]
+
+    def in_radius(self, location, radius):
+        """
+        Yields (village, distance) for every known village within radius of a location
+        Only the grid cells overlapping the radius are visited
+        """
+        x, y = location
+        min_cx, min_cy = self.cell_of((x - radius, y - radius))
+        max_cx, max_cy = self.cell_of((x + radius, y + radius))
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                for vid in self.grid.get((cx, cy), ()):
+                    vx, vy = self.map_pos[vid]
+                    distance = math.sqrt((x - vx) ** 2 + (y - vy) ** 2)
+                    if distance <= radius:
+                        yield self.villages[vid], distance
+
+
+class Map:
+    """
+    The world as seen from one own village
+    """
+    wrapper = None
+    village_id = None
+    my_location = None
+
+    def __init__(self, wrapper=None, village_id=None):
+        """
+        Creates a view on the shared world map
+        """
+        self.wrapper = wrapper
+        self.village_id = village_id
+        self.world = WorldMap.get(wrapper)
+
+    @property
+    def villages(self):
+        return self.world.villages
+
+    @property
+    def map_pos(self):
+        return PositionView(self.world)
+
+    def get_map(self):
+        """
+        Refreshes the world map around this village when needed
+        """
+        result = self.world.refresh(self.village_id)
+        self.my_location = self.world.location_of(self.village_id)
+        return result
 
     def in_cache(self, vid):
         """
@@ -153,6 +335,14 @@ class Map:
         entry = MapCache.get_cache(village_id=vid)
         return entry
 
+    def in_radius(self, radius):
+        """
+        Yields (village, distance) for every known village within radius of this village
+        """
+        if not self.my_location:
+            return iter(())
+        return self.world.in_radius(self.my_location, radius)
+
     def get_dist(self, ext_loc):
         """
         Calculates distance from current village to coords
@@ -164,20 +354,65 @@ class Map:
         return distance
 
 
+class PositionView:
+    """
+    Read-only village id -> location mapping over the world map, falling back to the store
+    """
+
+    def __init__(self, world):
+        self.world = world
+
+    def __contains__(self, vid):
+        return self.world.position(vid) is not None
+
+    def __getitem__(self, vid):
+        location = self.world.position(vid)
+        if location is None:
+            raise KeyError(vid)
+        return location
+
+    def get(self, vid, default=None):
+        location = self.world.position(vid)
+        return default if location is None else location
+
+
 class MapCache:
     """
     Holds a cache of all found villages within a certain distance
+    Only the most recently used max_entries villages are held in memory
     """
+    max_entries = 20000
+
+    @staticmethod
+    def table():
+        """
+        The write-back table holding the villages
+        """
+        return EntityStore.get().table("villages", max_entries=MapCache.max_entries)
+
     @staticmethod
     def get_cache(village_id):
         """
         Get data from the cache
         """
-        return FileManager.load_json_file(f"cache/villages/{village_id}.json")
+        return MapCache.table().get(village_id)
 
     @staticmethod
     def set_cache(village_id, entry):
         """
         Creates or updates a cache entry
         """
-        FileManager.save_json_file(entry, f"cache/villages/{village_id}.json")
+        MapCache.table().set(village_id, entry)
+
+    @staticmethod
+    def update(snapshot):
+        """
+        Compares a freshly parsed map with the known villages and writes only the changed ones in a single batch
+        """
+        table = MapCache.table()
+        known = table.get_many(snapshot)
+        changed = {vid: entry for vid, entry in snapshot.items() if known.get(str(vid)) != entry}
+        if changed:
+            table.update(changed)
+            table.flush()
+        return len(changed)
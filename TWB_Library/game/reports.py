@@ -1,13 +1,16 @@
 """
 Report management
 """
+import bisect
 import json
 import logging
 import re
+import time
 from datetime import datetime
 
 from core.extractors import Extractor
 from core.filemanager import FileManager
+from core.store import EntityStore, LRUCache
 
 
 class ReportManager:
@@ -18,7 +21,6 @@ class ReportManager:
     village_id = None
     game_state = None
     logger = None
-    last_reports = {}
 
     def __init__(self, wrapper=None, village_id=None):
         """
@@ -26,28 +28,17 @@ class ReportManager:
         """
         self.wrapper = wrapper
         self.village_id = village_id
+        self.index = ReportIndex.get()
 
     def has_resources_left(self, vid):
         """
         Checks if there are any resources left after farm
         Used by the farm manager script
         """
-        possible_reports = []
-        for repid in self.last_reports:
-            entry = self.last_reports[repid]
-            if vid == entry["dest"] and entry["extra"].get("when", None):
-                possible_reports.append(entry)
-        # self.logger.debug(f"Considered {len(possible_reports)} reports")
-        if len(possible_reports) == 0:
+        entry = self.index.newest(vid)
+        if not entry or not entry["extra"].get("when", None):
             return False, {}
 
-        def highest_when(attack):
-            """
-            Converts the date of an attack when resource gains were high
-            """
-            return datetime.fromtimestamp(int(attack["extra"]["when"]))
-
-        entry = max(possible_reports, key=highest_when)
         self.logger.debug("This is the newest? %s", datetime.fromtimestamp(int(entry["extra"]["when"])))
         if entry["extra"].get("resources", None):
             return True, entry["extra"]["resources"]
@@ -57,52 +48,70 @@ class ReportManager:
         """
         Calculates if a village is safe to engage without custom interaction
         Just sending a 0 losses attack overrides this behaviour
+        The newest report that tells something decides
         """
-        for repid in self.last_reports:
-            entry = self.last_reports[repid]
-            if vid == entry["dest"]:
-                if entry["type"] == "attack" and entry["losses"] == {}:
-                    return 1
-                if (
-                        entry["type"] == "scout"
-                        and entry["losses"] == {}
-                        and (
-                        entry["extra"]["defence_units"] == {}
-                        or entry["extra"]["defence_units"]
-                        == entry["extra"]["defence_losses"]
-                )
-                ):
-                    return 1
-
-                if entry["losses"] != {}:
-                    # Acceptable losses for attacks
-                    print(f'Units sent: {entry["extra"]["units_sent"]}')
-                    print(f'Units lost: {entry["losses"]}')
-
-                for sent_type in entry["extra"]["units_sent"]:
-                    amount = entry["extra"]["units_sent"][sent_type]
-                    if sent_type in entry["losses"]:
-                        if amount == entry["losses"][sent_type]:
-                            return 0  # Lost all units!
-                        elif entry["losses"][sent_type] <= 1:
-                            # Allow to lose 1 unit (luck depended)
-                            return 1  # Lost 'just' one unit
-
-                if entry["losses"] != {}:
-                    return 0  # Disengage if anything was lost!
+        for entry in self.index.newest_first(vid):
+            if entry["type"] == "attack" and entry["losses"] == {}:
+                return 1
+            if (
+                    entry["type"] == "scout"
+                    and entry["losses"] == {}
+                    and (
+                    entry["extra"]["defence_units"] == {}
+                    or entry["extra"]["defence_units"]
+                    == entry["extra"]["defence_losses"]
+            )
+            ):
+                return 1
+
+            if entry["losses"] != {}:
+                # Acceptable losses for attacks
+                print(f'Units sent: {entry["extra"]["units_sent"]}')
+                print(f'Units lost: {entry["losses"]}')
+
+            for sent_type in entry["extra"]["units_sent"]:
+                amount = entry["extra"]["units_sent"][sent_type]
+                if sent_type in entry["losses"]:
+                    if amount == entry["losses"][sent_type]:
+                        return 0  # Lost all units!
+                    elif entry["losses"][sent_type] <= 1:
+                        # Allow to lose 1 unit (luck depended)
+                        return 1  # Lost 'just' one unit
+
+            if entry["losses"] != {}:
+                return 0  # Disengage if anything was lost!
         return -1
 
-    def read(self, page=0, full_run=False):
+    def sync(self, full_run=False):
+        """
+        Reads the new reports of the whole account, meant to run once per cycle
+        Report ids only grow, so everything up to the stored high-water mark is skipped without a lookup
+        """
+        store = EntityStore.get()
+        high_water = store.get_meta("reports:high_water", 0)
+        newest = self.read(full_run=full_run, high_water=high_water)
+        if newest > high_water:
+            store.set_meta("reports:high_water", newest)
+        return newest
+
+    def scouted_defence(self, vid):
+        """
+        Defending units and wall level from the newest report that saw them, None if there is none
+        """
+        for entry in self.index.newest_first(vid):
+            if "defence_units" in entry["extra"]:
+                wall = entry["extra"].get("buildings", {}).get("wall", 0)
+                return entry["extra"]["defence_units"], wall
+        return None
+
+    def read(self, page=0, full_run=False, high_water=0):
         """
         Read some (or all if you like) reports
+        Returns the highest report id seen
         """
         if not self.logger:
             self.logger = logging.getLogger("Reports")
 
-        if len(self.last_reports) == 0:
-            self.logger.info("First run, re-reading cache entries")
-            self.last_reports = ReportCache.cache_grab()
-            self.logger.info("Got %d reports from cache", len(self.last_reports))
         offset = page * 12
         url = f"game.php?village={self.village_id}&screen=report&mode=all"
         if page > 0:
@@ -112,8 +121,9 @@ class ReportManager:
         new = 0
 
         ids = Extractor.report_table(result)
+        newest = max([int(report_id) for report_id in ids], default=high_water)
         for report_id in ids:
-            if report_id in self.last_reports:
+            if int(report_id) <= high_water or self.index.knows(report_id):
                 continue
             new += 1
             url = f"game.php?village={self.village_id}&screen=report&mode=all&group_id=0&view={report_id}"
@@ -128,13 +138,14 @@ class ReportManager:
 
                 else:
                     res = self.put(report_id, report_type=report_type)
-                    self.last_reports[report_id] = res
+                    self.index.add(report_id, res)
         if new == 12 or full_run and page < 20:
             page += 1
             self.logger.debug(
                 "%d new reports where added, also checking page %d", new, page
             )
-            return self.read(page, full_run=full_run)
+            return max(newest, self.read(page, full_run=full_run, high_water=high_water))
+        return newest
 
     def re_unit(self, inp):
         """
@@ -265,7 +276,7 @@ class ReportManager:
         res = self.put(
             report_id, attack_type, from_village, to_village, data=extra, losses=losses
         )
-        self.last_reports[report_id] = res
+        self.index.add(report_id, res)
         return True
 
     def put(
@@ -287,6 +298,7 @@ class ReportManager:
             "losses": losses,
             "extra": data,
         }
+        FarmStats.record(output)
         ReportCache.set_cache(report_id, output)
         self.logger.info(
             "Processed %s report with id %s", report_type, str(report_id)
@@ -296,29 +308,213 @@ class ReportManager:
 
 class ReportCache:
     """
-    File cache for local reports
+    Store backed cache for local reports
     """
     @staticmethod
     def get_cache(report_id):
         """
         Reads a report entry
         """
-        return FileManager.load_json_file(f"cache/reports/{report_id}.json")
+        return EntityStore.get().get_entity("reports", report_id)
 
     @staticmethod
     def set_cache(report_id, entry):
         """
         Creates a report entry
         """
-        FileManager.save_json_file(entry, f"cache/reports/{report_id}.json")
+        EntityStore.get().set_entity("reports", report_id, entry)
 
     @staticmethod
     def cache_grab():
         """
         Reads all locally stored reports
         """
-        output = {}
+        return EntityStore.get().all("reports")
 
-        for existing in FileManager.list_directory("cache/reports", ends_with=".json"):
-            output[existing.replace(".json", "")] = FileManager.load_json_file(f"cache/reports/{existing}")
-        return output
+
+class ReportIndex:
+    """
+    Reports of the account grouped per destination village and ordered by time
+    The reports of a destination are only loaded from the store when it is first asked for
+    Memory is bounded: reports older than horizon_days (except the newest one of a destination) stay on disk
+    and only the max_destinations most recently used destinations are held
+    """
+    horizon_days = 14
+    max_destinations = 2000
+    _instances = {}
+
+    def __init__(self):
+        self.by_dest = LRUCache(max_entries=self.max_destinations)
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the report index of the current account
+        """
+        key = FileManager.get_root()
+        if key not in cls._instances:
+            cls._instances[key] = cls()
+        return cls._instances[key]
+
+    @staticmethod
+    def sort_key(entry):
+        return int(entry["extra"].get("when", 0) or 0)
+
+    def knows(self, report_id):
+        """
+        Checks if a report was already processed, without loading any report
+        """
+        return EntityStore.get().has("reports", report_id)
+
+    def add(self, report_id, entry):
+        """
+        Registers a freshly processed report
+        """
+        dest = str(entry.get("dest"))
+        if dest in self.by_dest:
+            reports = self.by_dest[dest]
+            # Report ids are unique, so the tuples never have to compare the entries themselves
+            bisect.insort(reports, (self.sort_key(entry), str(report_id), entry))
+            self.by_dest[dest] = self.within_horizon(reports)
+
+    def reports_for(self, dest):
+        """
+        (when, report id, report) of a destination, oldest first
+        """
+        dest = str(dest)
+        if dest not in self.by_dest:
+            reports = EntityStore.get().by_ref("reports", dest)
+            self.by_dest[dest] = self.within_horizon(sorted(
+                ((self.sort_key(entry), report_id, entry) for report_id, entry in reports.items()),
+                key=lambda x: x[:2]
+            ))
+        return self.by_dest[dest]
+
+    def within_horizon(self, reports):
+        """
+        Drops the reports older than the horizon from a sorted list, the newest one is always kept
+        """
+        if not self.horizon_days or len(reports) < 2:
+            return reports
+        oldest = time.time() - self.horizon_days * 86400
+        start = min(bisect.bisect_left(reports, (oldest,)), len(reports) - 1)
+        return reports[start:]
+
+    def __len__(self):
+        return sum(len(reports) for reports in self.by_dest.values())
+
+    def newest(self, dest):
+        """
+        The most recent report of a destination
+        """
+        reports = self.reports_for(dest)
+        return reports[-1][2] if reports else None
+
+    def newest_first(self, dest):
+        """
+        Iterates the reports of a destination from new to old
+        """
+        for _, _, entry in reversed(self.reports_for(dest)):
+            yield entry
+
+
+class FarmStats:
+    """
+    Running totals of the own attacks on every farm, updated as reports come in
+    """
+    kind = "farm_stats"
+    logger = logging.getLogger("FarmStats")
+
+    @staticmethod
+    def empty():
+        """
+        Statistics of a farm without reports
+        """
+        return {
+            "attacks": 0,
+            "loot": {"wood": 0, "iron": 0, "stone": 0},
+            "units_sent": 0,
+            "units_lost": 0,
+        }
+
+    @staticmethod
+    def add(stats, report):
+        """
+        Adds a single attack report to the statistics of its farm
+        """
+        extra = report["extra"]
+        stats["units_sent"] += sum(extra.get("units_sent", {}).values())
+        stats["units_lost"] += sum(extra.get("units_losses", {}).values())
+        if "loot" in extra:
+            for resource, amount in extra["loot"].items():
+                stats["loot"][resource] = stats["loot"].get(resource, 0) + int(amount)
+            stats["attacks"] += 1
+        return stats
+
+    @staticmethod
+    def remove(stats, report):
+        """
+        Takes a single attack report out of the statistics of its farm
+        """
+        extra = report["extra"]
+        stats["units_sent"] = max(0, stats["units_sent"] - sum(extra.get("units_sent", {}).values()))
+        stats["units_lost"] = max(0, stats["units_lost"] - sum(extra.get("units_losses", {}).values()))
+        if "loot" in extra:
+            for resource, amount in extra["loot"].items():
+                stats["loot"][resource] = max(0, stats["loot"].get(resource, 0) - int(amount))
+            stats["attacks"] = max(0, stats["attacks"] - 1)
+        return stats
+
+    @staticmethod
+    def table():
+        """
+        Returns the statistics table, built from the stored reports the first time
+        """
+        store = EntityStore.get()
+        table = store.table(FarmStats.kind)
+        if not store.get_meta("backfilled:farm_stats"):
+            reports = store.all("reports")
+            output = {}
+            for report in reports.values():
+                if report["type"] == "attack" and report["dest"]:
+                    FarmStats.add(output.setdefault(report["dest"], FarmStats.empty()), report)
+            FarmStats.logger.info("Built farm statistics of %d farms from %d reports", len(output), len(reports))
+            table.update(output)
+            table.flush()
+            store.set_meta("backfilled:farm_stats", int(time.time()))
+        return table
+
+    @staticmethod
+    def record(report):
+        """
+        Accounts a new report, must be called before the report itself is stored
+        """
+        if report["type"] != "attack" or not report["dest"]:
+            return
+        table = FarmStats.table()
+        stats = table.get(report["dest"]) or FarmStats.empty()
+        table.set(report["dest"], FarmStats.add(stats, report))
+
+    @staticmethod
+    def prune_reports(keep):
+        """
+        Only keeps the keep newest reports, the removed ones are taken out of the statistics as well
+        so a farm recovers once its costly attacks are gone, returns how many reports were removed
+        """
+        store = EntityStore.get()
+        table = FarmStats.table()
+        for report in store.overflow("reports", keep).values():
+            if report["type"] != "attack" or not report["dest"]:
+                continue
+            stats = table.get(report["dest"])
+            if stats:
+                table.set(report["dest"], FarmStats.remove(stats, report))
+        table.flush()
+        return store.prune("reports", keep)
+
+    @staticmethod
+    def cache_grab():
+        """
+        Reads the statistics of all farms
+        """
+        return FarmStats.table().all()
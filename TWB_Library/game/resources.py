@@ -143,7 +143,7 @@ class ResourceManager:
         if gpl and self.do_premium_trade:
             url = f"game.php?village={self.village_id}&screen=market&mode=exchange"
             res = self.wrapper.get_url(url=url)
-            data = Extractor.premium_data(res.text)
+            data = Extractor.premium_data(res)
 
             premium_exchange = PremiumExchange(
                 wrapper=self.wrapper,
@@ -1,5 +1,8 @@
+import copy
 import math
 
+import numpy as np
+
 from core.filemanager import FileManager
 
 
@@ -237,6 +240,10 @@ class Simulator:
         "attack_archer": ["archer", "marcher"],
     }
 
+    def __init__(self, pool=None):
+        # Every simulator works on its own copy, the class table always holds the defaults
+        self.pool = copy.deepcopy(pool if pool is not None else Simulator.pool)
+
     def attack_sum(self, units):
         total = {"attack": 0, "attack_cavalry": 0, "attack_archer": 0}
         for unit in units:
@@ -309,100 +316,213 @@ class Simulator:
             )
         return max(0, resulting)
 
-    def simulate(self, attackerUnits, defenderUnits, wall, nightbonus, moral, luck):
-        wall = wall if wall else 0
-        moral = moral if moral else 100
-        moral /= 100
-        luck = luck if luck else 0
-        luck = 1 + luck / 100
-        nightbonus = 2 if nightbonus else 1
-
-        for item in self.pool:
-            if item not in attackerUnits:
-                attackerUnits[item] = 0
-            if item not in defenderUnits:
-                defenderUnits[item] = 0
-
-        attacker = {
-            "quantity": {},
-            "losses": {},
-        }
-        defender = {
-            "quantity": {},
-            "losses": {},
+    def unit_vectors(self):
+        """
+        Per-unit stats as arrays in the order of the pool
+        """
+        units = list(self.pool)
+        types = list(self.attack_units)
+        stats = {
+            "attack": np.array([self.pool[u]["attack"] for u in units], dtype=float),
+            "food": np.array([self.pool[u]["food"] for u in units], dtype=float),
+            # Defence of every unit against each of the attack types, shape (units, types)
+            "defense": np.array(
+                [[self.pool[u]["def_inf"], self.pool[u]["def_kav"], self.pool[u]["def_arc"]] for u in units],
+                dtype=float
+            ),
+            # Which attack type every unit fights as, shape (types, units)
+            "types": np.array([[self.attack_pool[u] == t for u in units] for t in types], dtype=float),
         }
+        return units, stats
 
-        for unit in self.pool:
-            attacker["quantity"][unit] = (
-                attackerUnits[unit] if unit in attackerUnits else 0
-            )
-            defender["quantity"][unit] = (
-                defenderUnits[unit] if unit in defenderUnits else 0
-            )
+    def to_array(self, compositions):
+        """
+        Converts a list of {unit: amount} dicts into an (n, units) array in pool order
+        """
+        units = list(self.pool)
+        output = np.zeros((len(compositions), len(units)))
+        for row, composition in enumerate(compositions):
+            for unit, amount in composition.items():
+                if unit in self.pool:
+                    output[row, units.index(unit)] = amount
+        return output
 
-        resultingWall = self.pre_wall(wall=wall, num_rams=attackerUnits["ram"])
-        wallBonus = 1 + resultingWall * 0.05
-        wallDefense = 0
-        if resultingWall != 0:
-            wallDefense = round(math.pow(1.25, resultingWall) * 20)
-        while self.get_sum(attackerUnits) >= 1 and self.get_sum(defenderUnits) >= 1:
-            attack_strength = self.attack_sum(attackerUnits)
-            def_strength = self.defense_sum(defenderUnits)
-            attack_sum = self.get_sum(attackerUnits)
-
-            attackFood = self.attack_sum_food(attackerUnits)
-            attackFoodSum = self.get_sum(attackFood)
-            print(attackFood, attackFoodSum)
-            defenderUnitsCopy = dict()
-
-            for unit in defenderUnits:
-                defenderUnitsCopy[unit] = defenderUnits[unit]
-
-            for attackType in attack_strength:
-                if attack_strength[attackType] == 0:
-                    continue
+    def simulate_batch(self, attackers, defenders, wall=0, nightbonus=False, moral=100, luck=0):
+        """
+        Simulates many battles at once
+        attackers and defenders are (n, units) arrays in pool order (or lists of unit dicts),
+        wall, nightbonus, moral and luck are scalars or arrays of length n
+        """
+        units, stats = self.unit_vectors()
+        attackers = self.to_array(attackers) if isinstance(attackers, list) else np.asarray(attackers, dtype=float)
+        defenders = self.to_array(defenders) if isinstance(defenders, list) else np.asarray(defenders, dtype=float)
+        n = attackers.shape[0]
+        wall = np.broadcast_to(np.nan_to_num(np.asarray(wall, dtype=float)), (n,))
+        moral = np.broadcast_to(np.asarray(moral, dtype=float), (n,)) / 100
+        luck = 1 + np.broadcast_to(np.asarray(luck, dtype=float), (n,)) / 100
+        night = np.where(np.broadcast_to(np.asarray(nightbonus, dtype=bool), (n,)), 2.0, 1.0)
 
-                ratio = attackFood[attackType] / attackFoodSum
+        rams = attackers[:, units.index("ram")]
+        wall_during = np.maximum(wall - np.round(rams / (4 * np.power(1.09, wall))), 0)
+        wall_bonus = 1 + wall_during * 0.05
+        wall_defense = np.where(wall_during != 0, np.round(np.power(1.25, wall_during) * 20), 0)
+
+        att = attackers.copy()
+        dfn = defenders.copy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            while True:
+                active = (np.round(att).sum(axis=1) >= 1) & (np.round(dfn).sum(axis=1) >= 1)
+                if not active.any():
+                    break
+                strength = (att * stats["attack"]) @ stats["types"].T
+                food = (att * stats["food"]) @ stats["types"].T
+                # The food total is summed from rounded per-type values, like get_sum does
+                ratio = np.nan_to_num(food / np.round(food).sum(axis=1, keepdims=True))
                 defense = (
-                        def_strength[attackType.replace("attack", "defense")]
-                        * ratio
-                        * wallBonus
-                        * nightbonus
-                        + wallDefense * ratio
+                    (dfn @ stats["defense"]) * ratio * (wall_bonus * night)[:, None]
+                    + wall_defense[:, None] * ratio
                 )
-                a = attack_strength[attackType] * moral * luck / defense
-                if a < 1:
-                    c = math.sqrt(a) * a
-                    for unit in defenderUnits:
-                        defenderUnits[unit] -= defenderUnitsCopy[unit] * c * ratio
-                    for i in self.attack_units[attackType]:
-                        unit = self.attack_units[attackType][i]
-                        attackerUnits[unit] = 0
-                else:
-                    c = math.sqrt(1 / a) / a
-                    for unit in defenderUnits:
-                        defenderUnits[unit] -= ratio * defenderUnitsCopy[unit]
-                    for i in self.attack_units[attackType]:
-                        unit = i
-                        attackerUnits[unit] -= c * attackerUnits[unit]
-
-        for unit in self.pool:
-            attacker["losses"][unit] = attacker["quantity"][unit] - round(
-                (attackerUnits[unit])
-            )
-            defender["losses"][unit] = defender["quantity"][unit] - round(
-                (defenderUnits[unit])
-            )
+                a = strength * (moral * luck)[:, None] / defense
+                fighting = (strength > 0) & active[:, None]
+                lost = fighting & (a < 1)
+                won = fighting & (a >= 1)
+                # Share of the defenders killed by every attack type
+                killed = np.where(lost, np.sqrt(a) * a, 0) + np.where(won, 1.0, 0)
+                dfn = dfn * (1 - (ratio * killed).sum(axis=1, keepdims=True))
+                # Surviving share of the attackers of every type
+                survive = np.where(lost, 0.0, np.where(won, 1 - np.nan_to_num(np.sqrt(1 / a) / a), 1.0))
+                att = att * (survive @ stats["types"])
+
+        attacker_losses = attackers - np.round(att)
+        defender_losses = defenders - np.round(dfn)
+        return {
+            "units": units,
+            "attacker_losses": attacker_losses,
+            "defender_losses": defender_losses,
+            "attacker_left": attackers - attacker_losses,
+            "defender_left": defenders - defender_losses,
+            "wall_before": wall,
+            "wall_during": wall_during,
+            "wall_after": self.post_wall_batch(attackers, defenders, attacker_losses, defender_losses, wall),
+        }
+
+    def post_wall_batch(self, attackers, defenders, attacker_losses, defender_losses, wall):
+        """
+        Wall level after the battle for every simulated row
+        """
+        ram = list(self.pool).index("ram")
+        rams = attackers[:, ram]
+        ram_attack = self.pool["ram"]["attack"]
+        def_sum = np.round(defenders).sum(axis=1)
+        att_sum = np.round(attackers).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lose_def = np.where(def_sum != 0, np.round(defender_losses).sum(axis=1) / def_sum, 1)
+            lose_att = np.nan_to_num(np.round(attacker_losses).sum(axis=1) / att_sum)
+        dmg = rams * ram_attack / (4 * np.power(1.09, wall))
+        resulting = np.where(
+            lose_def == 1,
+            wall - np.round(dmg - 0.5 * dmg * lose_att),
+            wall - np.round(rams * ram_attack * lose_def / (8 * np.power(1.09, wall))),
+        )
+        resulting = np.where((rams == 0) | (wall == 0), wall, resulting)
+        return np.maximum(resulting, 0)
+
+    def simulate(self, attackerUnits, defenderUnits, wall, nightbonus, moral, luck):
+        result = self.simulate_batch(
+            [attackerUnits], [defenderUnits],
+            wall=wall or 0, nightbonus=bool(nightbonus), moral=moral or 100, luck=luck or 0
+        )
+        attacker = {"quantity": {}, "losses": {}}
+        defender = {"quantity": {}, "losses": {}}
+        for index, unit in enumerate(result["units"]):
+            attacker["quantity"][unit] = attackerUnits.get(unit, 0)
+            defender["quantity"][unit] = defenderUnits.get(unit, 0)
+            attacker["losses"][unit] = int(result["attacker_losses"][0, index])
+            defender["losses"][unit] = int(result["defender_losses"][0, index])
 
         return {
             "attacker": attacker,
             "defender": defender,
-            "wall_before": wall,
-            "wall_during": resultingWall,
-            "wall_after": self.post_wall(attacker, defender, wall),
+            "wall_before": wall if wall else 0,
+            "wall_during": int(result["wall_during"][0]),
+            "wall_after": int(result["wall_after"][0]),
         }
 
 
+class TroopSolver:
+    """
+    Finds the cheapest troops out of what a village has that clear a known defence
+    Every candidate mix is scaled down by bisection, all candidates are simulated in the same batch
+    """
+    # Bisection steps, 2^-14 of the available troops is below one unit for any realistic village
+    steps = 14
+    # Units that never go out to clear a farm
+    excluded = ("snob",)
+
+    def __init__(self, simulator=None):
+        self.sim = simulator or Simulator()
+
+    def candidates(self, available):
+        """
+        Base compositions to scale: every single attacking unit type and everything together
+        """
+        units = list(self.sim.pool)
+        base = np.array([float(available.get(unit, 0) or 0) for unit in units])
+        for unit in self.excluded:
+            base[units.index(unit)] = 0
+        rows = []
+        for index, unit in enumerate(units):
+            if base[index] > 0 and self.sim.pool[unit]["attack"] > 0:
+                row = np.zeros(len(units))
+                row[index] = base[index]
+                rows.append(row)
+        if len(rows) > 1:
+            rows.append(base)
+        return units, np.array(rows)
+
+    def cost(self, compositions):
+        """
+        Training time of the troops put at risk, used to pick the cheapest working candidate
+        """
+        build_time = np.array([self.sim.pool[unit]["build_time"] for unit in self.sim.pool], dtype=float)
+        return compositions @ build_time
+
+    def solve(self, available, defenders, wall=0, max_losses=0, moral=100, luck=0):
+        """
+        Returns the cheapest {unit: amount} that kills every defender losing at most max_losses units,
+        None if even everything available is not enough
+        """
+        units, base = self.candidates(available)
+        if not len(base):
+            return None
+        defence = self.sim.to_array([defenders])
+        defence = np.repeat(defence, len(base), axis=0)
+
+        def wins(scale):
+            troops = np.ceil(base * scale[:, None])
+            result = self.sim.simulate_batch(troops, defence, wall=wall or 0, moral=moral, luck=luck)
+            cleared = result["defender_left"].sum(axis=1) == 0
+            return troops, cleared & (result["attacker_losses"].sum(axis=1) <= max_losses)
+
+        low = np.zeros(len(base))
+        high = np.ones(len(base))
+        _, possible = wins(high)
+        if not possible.any():
+            return None
+        for _ in range(self.steps):
+            middle = (low + high) / 2
+            _, ok = wins(middle)
+            high = np.where(ok, middle, high)
+            low = np.where(ok, low, middle)
+        troops, ok = wins(high)
+        ok &= possible
+        if not ok.any():
+            return None
+        costs = np.where(ok, self.cost(troops), np.inf)
+        best = troops[int(np.argmin(costs))]
+        return {unit: int(best[index]) for index, unit in enumerate(units) if best[index] > 0}
+
+
 class SimCache:
     @staticmethod
     def get_cache(world):
@@ -418,13 +538,49 @@ class SimCache:
         if current:
             return current
         result = session.get_action(village_id=village_id, action="unit_info&ajax=data")
-        if result:
-            SimCache.set_cache(world=world, entry=result.json())
+        if not result:
+            return None
+        try:
+            entry = result.json()
+        except ValueError:
+            return None
+        SimCache.set_cache(world=world, entry=entry)
+        return entry
+
+    # Names the unit_info popup data uses for the fields of the pool
+    unit_info_fields = {
+        "speed": "speed",
+        "carry": "load",
+        "load": "load",
+        "attack": "attack",
+        "defense": "def_inf",
+        "def_inf": "def_inf",
+        "defense_cavalry": "def_kav",
+        "def_kav": "def_kav",
+        "defense_archer": "def_arc",
+        "def_arc": "def_arc",
+        "pop": "food",
+        "build_time": "build_time",
+    }
 
     @staticmethod
     def cache_customize(entry):
+        """
+        Converts the unit_info popup data into {unit: {pool field: value}} for update_with_real_levels
+        """
         if not entry:
             return {}
-
-        for unit in entry["response"]["unit_data"]:
-            return
+        units = entry.get("response", {}).get("unit_data", {}) if isinstance(entry, dict) else {}
+        levels = {}
+        for unit, data in units.items():
+            if not isinstance(data, dict):
+                continue
+            values = {}
+            for key, field in SimCache.unit_info_fields.items():
+                try:
+                    values[field] = float(data[key])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            if values:
+                levels[unit] = values
+        return levels
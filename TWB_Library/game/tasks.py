@@ -0,0 +1,88 @@
+"""
+Village task scheduling
+Remembers when every task of a village is due again so a cycle only visits the villages that have work
+"""
+import logging
+import threading
+import time
+
+from core.filemanager import FileManager
+
+
+class TaskScheduler:
+    """
+    Next-due timestamp per (village, task)
+    Tasks waiting on the game (a full build queue, busy barracks, scavenging squads) are due when that finishes,
+    tasks without a known finish time are due again after the regular cycle delay
+    """
+    # Order in which a village runs its tasks
+    tasks = ("quests", "build", "units", "farm", "hunter", "gather", "market")
+    # Default delay until a task is due again, set every cycle from the active or inactive delay
+    interval = 600
+    logger = logging.getLogger("TaskScheduler")
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.due = {}
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the scheduler of the current account
+        """
+        key = FileManager.get_root()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls()
+            return cls._instances[key]
+
+    def due_at(self, village_id, task):
+        """
+        Moment a task is due, 0 for tasks that never ran
+        """
+        with self.lock:
+            return self.due.get(village_id, {}).get(task, 0)
+
+    def is_due(self, village_id, task, now=None):
+        return self.due_at(village_id, task) <= (now or time.time())
+
+    def defer(self, village_id, task, until=None):
+        """
+        Sets when a task is due again, after the regular interval when no finish time is known
+        """
+        now = time.time()
+        if not until or until <= now:
+            until = now + self.interval
+        with self.lock:
+            self.due.setdefault(village_id, {})[task] = until
+        return until
+
+    def next_due(self, village_id, tasks=None):
+        """
+        Earliest moment one of the given tasks of a village is due, infinity without any task
+        """
+        with self.lock:
+            entry = self.due.get(village_id, {})
+            return min((entry.get(task, 0) for task in (self.tasks if tasks is None else tasks)), default=float("inf"))
+
+    def wake(self, village_id=None):
+        """
+        Makes every task of a village, or of all villages, due right away
+        """
+        with self.lock:
+            if village_id:
+                self.due.pop(village_id, None)
+            else:
+                self.due.clear()
+
+    def describe(self, village_id, tasks=None):
+        now = time.time()
+        with self.lock:
+            entry = self.due.get(village_id, {})
+            return ", ".join(
+                "%s %s" % (task, "now" if entry.get(task, 0) <= now else "in %d min" % ((entry[task] - now) // 60))
+                for task in (self.tasks if tasks is None else tasks)
+            ) or "no tasks"
@@ -9,6 +9,7 @@ import time
 
 from core.extractors import Extractor
 from game.resources import ResourceManager
+from game.world import WorldConstants
 
 
 class TroopManager:
@@ -60,6 +61,8 @@ class TroopManager:
     wanted_levels = {}
 
     last_gather = 0
+    # Earliest return of the scavenging squads seen underway on the last gather run
+    gather_returns = 0
 
     resman = None
     template = None
@@ -76,14 +79,18 @@ class TroopManager:
                 wrapper=self.wrapper, village_id=self.village_id
             )
 
-    def update_totals(self):
+    def update_totals(self, game_data=None):
         """
         Updates the total amount of recruited units
+        The village overview is only read when no current game state is given
         """
-        main_data = self.wrapper.get_action(
-            action="overview", village_id=self.village_id
-        )
-        self.game_data = Extractor.game_state(main_data)
+        if game_data:
+            self.game_data = game_data
+        else:
+            main_data = self.wrapper.get_action(
+                action="overview", village_id=self.village_id
+            )
+            self.game_data = Extractor.game_state(main_data)
 
         if self.resman:
             if "research" in self.resman.requested:
@@ -418,7 +425,7 @@ class TroopManager:
                 self.logger.warning("Failed to update CSRF token: %s", str(token_error))
             
             # Prepare headers for API request
-            custom_headers = dict(self.wrapper.headers)
+            custom_headers = self.wrapper.request_headers()
             custom_headers.update({
                 'Accept': "application/json, text/javascript, */*; q=0.01",
                 'Accept-Language': "pt-BR,pt;q=0.9",
@@ -734,6 +741,12 @@ class TroopManager:
             return False
             
         village_data = Extractor.village_data(result)
+        returns = [
+            int(option["scavenging_squad"].get("return_time") or 0)
+            for option in (village_data or {}).get("options", {}).values()
+            if option.get("scavenging_squad")
+        ]
+        self.gather_returns = min(returns) if returns else 0
 
         sleep = 0
         available_selection = 0
@@ -753,14 +766,11 @@ class TroopManager:
 
         troops = dict(self.troops)
 
-        haul_dict = [
-            "spear:25",
-            "sword:15",
-            "axe:10",
-            "heavy:50"
-        ]
+        haul_units = ["spear", "sword", "axe", "heavy"]
         if "archer" in self.total_troops:
-            haul_dict.extend(["archer:10", "marcher:50"])
+            haul_units.extend(["archer", "marcher"])
+        world = WorldConstants.get()
+        haul_dict = ["%s:%d" % (unit, world.carry(unit)) for unit in haul_units]
 
         # ADVANCED GATHER: Goes from gather_selection to 1, trying the same time (approximately) for every gather. Active hours exclude LC and Axes, at night everything is used for gather (except Paladin)
 
@@ -1041,6 +1051,15 @@ class TroopManager:
             req = resources[res] * (wanted_times - has_times)
             self.resman.request(source=f"recruitment_{unit_type}", resource=res, amount=req)
 
+    def busy_until(self, buildings, research=False):
+        """
+        Moment the first of the given recruit buildings, or the smith, is free again, in the past when one is idle
+        """
+        waits = [self.wait_for.get(self.village_id, {}).get(building, 0) for building in buildings]
+        if research:
+            waits.append(self._research_wait)
+        return min(waits) if waits else 0
+
     def readable_ts(self, seconds):
         """
         Human readable timestamp
@@ -16,7 +16,9 @@ from game.map import Map
 from game.reports import ReportManager
 from game.resources import ResourceManager
 from game.snobber import SnobManager
+from game.tasks import TaskScheduler
 from game.troopmanager import TroopManager
+from pages.overview import AccountSnapshot
 from core.exceptions import *
 
 
@@ -134,7 +136,7 @@ class Village:
 
     def update_pre_run(self):
         """
-        Manage defence, resources and reports
+        Manage defence and resources, reports are read once per cycle for the whole account
         """
         if not self.resman:
             self.resman = ResourceManager(
@@ -150,7 +152,6 @@ class Village:
             self.rep_man = ReportManager(
                 wrapper=self.wrapper, village_id=self.village_id
             )
-        self.rep_man.read(full_run=False)
 
         if not self.def_man:
             self.def_man = DefenceManager(
@@ -182,7 +183,7 @@ class Village:
             self.village_id, parameter="evacuate_fragile_units_on_attack", default=False
         )
         self.def_man.update(
-            data.text,
+            data.text if data is not None else "",
             with_defence=self.get_config(
                 section="units", parameter="manage_defence", default=False
             ),
@@ -607,6 +608,12 @@ class Village:
             self.attack.scout_farm_amount = self.get_config(
                 section="farms", parameter="farm_scout_amount", default=5
             )
+            self.attack.clear_farms = self.get_config(
+                section="farms", parameter="clear_scouted_farms", default=False
+            )
+            self.attack.clear_max_losses = self.get_config(
+                section="farms", parameter="clear_max_losses", default=5
+            )
 
             # Verificação final antes de executar
             if not self.attack.map or not self.attack.map.villages:
@@ -698,19 +705,6 @@ class Village:
         Check and execute scheduled Hunter attacks
         """
         try:
-            # Load scheduled attacks from cache
-            hunter_data = FileManager.load_json_file("cache/hunter/scheduled_attacks.json")
-            
-            if not hunter_data:
-                self.logger.debug("Hunter: No scheduled attacks found")
-                return
-            
-            hunter_schedule = hunter_data.get("hunter_schedule", {})
-            
-            if not hunter_schedule:
-                self.logger.debug("Hunter: Empty schedule")
-                return
-            
             # Initialize Hunter if needed
             if not self.hunter:
                 from game.hunter import Hunter
@@ -719,99 +713,141 @@ class Village:
                 self.hunter.game_map = self.area
                 self.logger.debug("Hunter: Initialized")
             
-            # Rebuild Hunter schedule
-            current_time = time.time()
-            attacks_found = 0
+            # The schedule is shared by all villages and only re-read when the file changed
+            from game.hunter import HunterSchedule
+            schedule = HunterSchedule.get()
+            schedule.refresh(self.hunter.longest_travel_time, now=self.hunter.now())
+            
+            due = schedule.pop_due(self.hunter.now() + self.hunter.activation_lead, source=self.village_id)
+            if not due:
+                entry = schedule.peek(self.village_id)
+                if entry:
+                    self.logger.debug("Hunter: Next send in %d minutes at %s",
+                                      int((entry[0] - self.hunter.now()) // 60),
+                                      datetime.fromtimestamp(entry[0]).strftime('%H:%M:%S'))
+                return
             
-            for timestamp_str, attacks in hunter_schedule.items():
-                timestamp = float(timestamp_str)
+            for send_time, arrival_time, source, key in due:
+                attacks = schedule.pending(key, self.village_id)
+                if not attacks:
+                    continue
+                arrival_dt = datetime.fromtimestamp(arrival_time)
+                self.logger.info("Hunter: Activating for attack scheduled to arrive at %s", arrival_dt.strftime('%H:%M:%S'))
                 
-                # Filter only attacks for this village that have not been executed
-                village_attacks = []
-                for attack in attacks:
-                    if attack.get("source") == self.village_id:
-                        # Check if attack was already executed
-                        if attack.get("status") == "executed":
-                            self.logger.debug("Hunter: Attack '%s' already executed, skipping", attack.get('id'))
-                            continue
-                        
-                        village_attacks.append(attack)
-                        attacks_found += 1
+                # Verify available troops
+                has_troops = True
+                for unit, amount in attacks[0].get("troops", {}).items():
+                    available = int(self.units.troops.get(unit, 0))
+                    if available < amount:
+                        self.logger.warning("Hunter: Insufficient troops: %s (have %d, need %d)", unit, available, amount)
+                        has_troops = False
                 
-                if village_attacks:
-                    self.hunter.schedule[timestamp] = village_attacks
-            
-            if attacks_found > 0:
-                self.logger.debug("Hunter: %d attacks found for this village", attacks_found)
+                if not has_troops:
+                    # Tried again next cycle as long as the arrival can still be made
+                    self.logger.warning("Hunter: Attack postponed due to insufficient troops")
+                    schedule.push(send_time, arrival_time, source, key)
+                    continue
                 
-                # Check if within timing window (15 minutes before arrival)
-                if self.hunter.nearing_schedule_window():
-                    arrival_time = self.hunter.nearing_schedule_window()
-                    arrival_dt = datetime.fromtimestamp(arrival_time)
-                    
-                    self.logger.info("Hunter: Activating for attack scheduled to arrive at %s", arrival_dt.strftime('%H:%M:%S'))
-                    
-                    # Check if sufficient troops are available
-                    attack_data = self.hunter.schedule[arrival_time][0]  # First attack
-                    required_troops = attack_data.get("troops", {})
-                    
-                    # Verify available troops
-                    has_troops = True
-                    for unit, amount in required_troops.items():
-                        available = int(self.units.troops.get(unit, 0))
-                        if available < amount:
-                            self.logger.warning("Hunter: Insufficient troops: %s (have %d, need %d)", unit, available, amount)
-                            has_troops = False
-                    
-                    if has_troops:
-                        # Log timing information
-                        current_time = time.time()
-                        current_dt = datetime.fromtimestamp(current_time)
-                        time_until_arrival = arrival_time - current_time
-                        
-                        self.logger.info("Hunter: Starting attack preparation")
-                        self.logger.info("Hunter: Desired arrival: %s (in %.1f minutes)", arrival_dt.strftime('%H:%M:%S'), time_until_arrival/60)
-                        
-                        # Execute attacks (arrival_time = desired arrival time)
-                        success = self.hunter.send_attack_chain(
-                            source=self.village_id,
-                            item=arrival_time,
-                            exact_arrival_time=arrival_time
-                        )
-                        
-                        if success:
-                            self.logger.info("Hunter: Attacks executed successfully")
-                            
-                            # Mark as executed in cache
-                            for attack in self.hunter.schedule[arrival_time]:
-                                attack["status"] = "executed"
-                                attack["executed_at"] = datetime.now().isoformat()
-                            
-                            # Save updated cache
-                            hunter_data["hunter_schedule"][str(arrival_time)] = self.hunter.schedule[arrival_time]
-                            FileManager.save_json_file(hunter_data, "cache/hunter/scheduled_attacks.json")
-                        else:
-                            self.logger.error("Hunter: Failed to execute attacks")
-                                
-                    else:
-                        self.logger.warning("Hunter: Attack cancelled due to insufficient troops")
+                self.logger.info("Hunter: Starting attack preparation")
+                self.logger.info("Hunter: Desired arrival: %s (in %.1f minutes)", arrival_dt.strftime('%H:%M:%S'),
+                                 (arrival_time - self.hunter.now())/60)
+                
+                # Execute attacks (arrival_time = desired arrival time)
+                self.hunter.schedule = {arrival_time: attacks}
+                success = self.hunter.send_attack_chain(
+                    source=self.village_id,
+                    item=arrival_time,
+                    exact_arrival_time=arrival_time
+                )
+                schedule.mark(key, self.village_id, attacks, "executed" if success else "failed")
+                if success:
+                    self.logger.info("Hunter: Attacks executed successfully")
                 else:
-                    # Show next attack
-                    if self.hunter.schedule:
-                        next_attack = min(self.hunter.schedule.keys())
-                        time_until = next_attack - current_time
-                        if time_until > 0:
-                            minutes = int(time_until // 60)
-                            next_arrival_dt = datetime.fromtimestamp(next_attack)
-                            self.logger.debug("Hunter: Next arrival in %d minutes at %s", minutes, next_arrival_dt.strftime('%H:%M:%S'))
-            else:
-                self.logger.debug("Hunter: No attacks found for this village")
+                    self.logger.error("Hunter: Failed to execute attacks")
                 
         except Exception as e:
             self.logger.error("Hunter: Error - %s", str(e))
             import traceback
             traceback.print_exc()
 
+    def enabled_tasks(self):
+        """
+        Tasks the config turns on for this village, decided without any request
+        """
+        enabled = {
+            "quests": self.get_config(section="world", parameter="quests_enabled", default=False),
+            "build": self.get_village_config(self.village_id, parameter="building", default=None) is not False
+            and self.get_config(section="building", parameter="manage_buildings", default=True),
+            "units": self.get_config(section="units", parameter="recruit", default=False)
+            or self.get_config(section="units", parameter="upgrade", default=False)
+            or self.get_village_config(self.village_id, parameter="snobs", default=None),
+            "farm": self.get_config(section="farms", parameter="farm", default=False),
+            "hunter": not self.get_config(section="hunter", parameter="daemon", default=True),
+            "gather": self.get_village_config(self.village_id, parameter="gather_enabled", default=False),
+            "market": self.get_config(section="market", parameter="auto_trade", default=False) or (
+                self.get_config(section="world", parameter="trade_for_premium", default=False)
+                and self.get_village_config(self.village_id, parameter="trade_for_premium", default=False)
+            ),
+        }
+        return [task for task in TaskScheduler.tasks if enabled[task]]
+
+    def next_due(self, config):
+        """
+        Moment the village has work again, 0 if it never ran and infinity if it is not managed
+        """
+        self.config = config
+        if not self.logger or not self.builder:
+            return 0
+        if not self.get_village_config(self.village_id, parameter="managed", default=False):
+            return float("inf")
+        return TaskScheduler.get().next_due(self.village_id, self.enabled_tasks())
+
+    def needs_overview(self, due):
+        """
+        The overview of the village is only read for what the account overview lacks,
+        the incoming attacks of the village and its quest data
+        """
+        if "quests" in due:
+            return True
+        return AccountSnapshot.get().incomings != 0
+
+    def build_due(self):
+        """
+        The build task waits for the first queue slot when the queue is full
+        """
+        if self.builder.is_queued():
+            return min(self.builder.waits)
+        return None
+
+    def units_due(self):
+        """
+        The units task waits until the first recruit building in use, or the smith, is idle again
+        """
+        buildings = []
+        if self.get_config(section="units", parameter="recruit", default=False):
+            buildings = [building for building in self.units.wanted if self.builder.get_level(building)]
+        research = self.get_config(section="units", parameter="upgrade", default=False) and self.units.wanted_levels
+        if self.get_village_config(self.village_id, parameter="snobs", default=None) or (
+                not buildings and not research):
+            return None
+        return self.units.busy_until(buildings, research=bool(research))
+
+    def gather_due(self, started):
+        """
+        The gather task waits for the first squad to return, unless squads were sent just now
+        """
+        if self.units.last_gather >= started:
+            return None
+        return self.units.gather_returns or None
+
+    def hunter_due(self):
+        """
+        The hunter task of a village without the daemon wakes up when its next chain has to be prepared
+        """
+        from game.hunter import Hunter, HunterSchedule
+        entry = HunterSchedule.get().peek(self.village_id)
+        return entry[0] - Hunter.activation_lead if entry else None
+
     def run(self, config=None, first_run=False):
         # setup and check if village still exists / is accessible
         self.config = config
@@ -819,7 +855,24 @@ class Village:
             section="bot", parameter="delay_factor", default=1.0
         )
 
-        data = self.village_init()
+        # Only tasks that are due run, everything runs on the first visit of the village
+        tasks = TaskScheduler.get()
+        started = time.time()
+        first = not self.logger or not self.builder or not self.units
+        due = None if first else {
+            task for task in self.enabled_tasks() if tasks.is_due(self.village_id, task, started)
+        }
+
+        # Resources, storage and farm come from the account overview unless the page of the village is needed
+        data = None
+        state = None
+        if not first and not self.needs_overview(due):
+            state = AccountSnapshot.get().village_state(self.village_id, self.game_data)
+        if state:
+            self.game_data = state
+            self.logger.info("Read game state for village from the account overview")
+        else:
+            data = self.village_init()
 
         if not self.game_data:
             self.logger.error(
@@ -840,31 +893,55 @@ class Village:
         if not self.game_data:
             raise InvalidGameStateException
 
+        if due is None:
+            due = set(self.enabled_tasks())
+        self.logger.debug("Due tasks: %s", ", ".join(sorted(due)) or "none")
+
         self.update_pre_run()
 
         self.setup_defence_manager(data=data)
-        self.run_quest_actions(config=config)
-
-        self.run_builder()
+        if "quests" in due:
+            self.run_quest_actions(config=config)
+            tasks.defer(self.village_id, "quests")
+
+        if first or "build" in due:
+            self.run_builder()
+            tasks.defer(self.village_id, "build", self.build_due())
+        elif data is not None:
+            # Recruiting depends on the building levels, the overview already has them
+            self.builder.levels = {
+                building: int(level) for building, level in self.game_data["village"]["buildings"].items()
+            }
         self.units_get_template()
         self.set_unit_wanted_levels()
 
-        self.units.update_totals()
-        self.run_unit_upgrades()
-        self.run_snob_recruit()
-        self.do_recruit()
+        if first or "units" in due or "farm" in due:
+            self.units.update_totals(game_data=self.game_data)
+        if "units" in due:
+            self.run_unit_upgrades()
+            self.run_snob_recruit()
+            self.do_recruit()
+            tasks.defer(self.village_id, "units", self.units_due())
         self.manage_local_resources()
 
-        self.run_farming()
+        if "farm" in due:
+            self.run_farming()
+            tasks.defer(self.village_id, "farm")
 
-        # Check for scheduled Hunter attacks
-        self.check_hunter_attacks()
+        # Scheduled Hunter attacks run on the hunter daemon unless it is disabled
+        if "hunter" in due:
+            self.check_hunter_attacks()
+            tasks.defer(self.village_id, "hunter", self.hunter_due())
 
-        self.do_gather()
-        self.go_manage_market()
+        if "gather" in due:
+            self.do_gather()
+            tasks.defer(self.village_id, "gather", self.gather_due(started))
+        if "market" in due:
+            self.go_manage_market()
+            tasks.defer(self.village_id, "market")
 
         self.set_cache_vars()
-        self.logger.info("Village cycle done, returning to overview")
+        self.logger.info("Village cycle done (%s)", tasks.describe(self.village_id, self.enabled_tasks()))
         self.wrapper.reporter.report(
             self.village_id, "TWB_POST_RESOURCE", str(self.resman.actual)
         )
@@ -0,0 +1,236 @@
+"""
+World constants
+Unit speeds, carry capacities and combat values of the world the account plays on, read once from the game
+"""
+import logging
+import math
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass
+
+from core.filemanager import FileManager
+from game.simulator import Simulator, SimCache, TroopSolver
+
+
+@dataclass(frozen=True)
+class UnitStats:
+    """
+    Numbers of a single unit type, speed is in minutes per field with the world and unit speed applied
+    """
+    name: str
+    speed: float
+    carry: int
+    attack: int
+    defense: int
+    defense_cavalry: int
+    defense_archer: int
+    pop: int
+    build_time: float
+
+
+class WorldConstants:
+    """
+    Per-unit table of the current world, parsed from interface.php or the cached unit_info and kept on disk
+    Falls back to the simulator defaults scaled by the world speed when the game can not be asked
+    """
+    path = "cache/world/constants.json"
+    # The unit table of a world never changes, it is only refreshed in case the account moved to another world
+    max_age = 7 * 86400
+    # Simulator pool field for every UnitStats field
+    pool_fields = {
+        "speed": "speed",
+        "carry": "load",
+        "attack": "attack",
+        "defense": "def_inf",
+        "defense_cavalry": "def_kav",
+        "defense_archer": "def_arc",
+        "pop": "food",
+        "build_time": "build_time",
+    }
+    logger = logging.getLogger("WorldConstants")
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, units=None, speed=1.0, unit_speed=1.0, source="defaults"):
+        self.speed = speed
+        self.unit_speed = unit_speed
+        self.source = source
+        # Set once the game was asked, a failed attempt is not repeated every cycle
+        self.asked = False
+        self.units = units or self.default_units(speed, unit_speed)
+        # Simulator and solver of this account, calibrated with the values of its world
+        self.simulator = Simulator()
+        self.solver = TroopSolver(self.simulator)
+
+    @classmethod
+    def get(cls, wrapper=None, village_id=None):
+        """
+        Returns the constants of the current account, asking the game only once when a wrapper is given
+        """
+        key = FileManager.get_root()
+        with cls._instances_lock:
+            world = cls._instances.get(key)
+            if not world or (wrapper and world.source == "defaults" and not world.asked):
+                world = cls.load(wrapper, village_id)
+                world.asked = wrapper is not None
+                cls._instances[key] = world
+                world.calibrate()
+            return world
+
+    @classmethod
+    def load(cls, wrapper=None, village_id=None):
+        """
+        Reads the table from disk, fetching and parsing it when it is missing or outdated
+        """
+        cached = FileManager.load_json_file(cls.path)
+        server = wrapper.server if wrapper else None
+        if cached and time.time() - cached.get("fetched", 0) < cls.max_age and (
+                not server or cached.get("server") == server):
+            return cls.from_entry(cached)
+        if not wrapper:
+            return cls.from_entry(cached) if cached else cls()
+        world = cls.fetch(wrapper, village_id)
+        if world.source != "defaults":
+            entry = world.to_entry()
+            entry["server"] = server
+            FileManager.save_json_file(entry, cls.path)
+        return world
+
+    @classmethod
+    def fetch(cls, wrapper, village_id=None):
+        """
+        Asks the public world interface, the unit_info popup data is used if that is not available
+        """
+        config = cls.parse_xml(wrapper.get_url("interface.php?func=get_config"))
+        speed = float(config.get("speed", 1) or 1)
+        unit_speed = float(config.get("unit_speed", 1) or 1)
+        units = {}
+        for name, values in cls.parse_xml(wrapper.get_url("interface.php?func=get_unit_info")).items():
+            if isinstance(values, dict) and "speed" in values:
+                units[name] = cls.make_unit(name, values)
+        if units:
+            cls.logger.info("Loaded %d units of world speed %s (unit speed %s)", len(units), speed, unit_speed)
+            return cls(units, speed, unit_speed, source="interface")
+        if village_id:
+            levels = SimCache.cache_customize(SimCache.grab_cache(wrapper.server, wrapper, village_id))
+            if levels:
+                cls.logger.info("Loaded %d units from the unit info cache", len(levels))
+                defaults = cls.default_units(speed, unit_speed)
+                units = {
+                    name: cls.make_unit(name, {
+                        field: levels[name].get(pool_field, getattr(defaults[name], field, 0))
+                        for field, pool_field in cls.pool_fields.items()
+                    })
+                    for name in levels if name in defaults
+                }
+                return cls(units, speed, unit_speed, source="unit_info")
+        cls.logger.warning("Unable to read the world constants, using default unit values")
+        return cls(speed=speed, unit_speed=unit_speed)
+
+    @staticmethod
+    def parse_xml(response):
+        """
+        Turns an interface.php document into nested dicts of strings, empty if it could not be parsed
+        """
+        if response is None:
+            return {}
+        try:
+            root = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError:
+            return {}
+
+        def convert(node):
+            if len(node):
+                return {child.tag: convert(child) for child in node}
+            return (node.text or "").strip()
+
+        return convert(root) if len(root) else {}
+
+    @classmethod
+    def make_unit(cls, name, values):
+        """
+        Builds the stats of a unit out of a dict with UnitStats field names
+        """
+        return UnitStats(
+            name=name,
+            speed=float(values.get("speed", 0) or 0),
+            carry=int(float(values.get("carry", 0) or 0)),
+            attack=int(float(values.get("attack", 0) or 0)),
+            defense=int(float(values.get("defense", 0) or 0)),
+            defense_cavalry=int(float(values.get("defense_cavalry", 0) or 0)),
+            defense_archer=int(float(values.get("defense_archer", 0) or 0)),
+            pop=int(float(values.get("pop", 0) or 0)),
+            build_time=float(values.get("build_time", 0) or 0),
+        )
+
+    @classmethod
+    def default_units(cls, speed=1.0, unit_speed=1.0):
+        """
+        The simulator defaults, speeds and build times scaled to the world
+        """
+        units = {}
+        for name, values in Simulator.pool.items():
+            stats = {field: values.get(pool_field, 0) for field, pool_field in cls.pool_fields.items()}
+            stats["speed"] = stats["speed"] / (speed * unit_speed)
+            stats["build_time"] = stats["build_time"] / speed
+            units[name] = cls.make_unit(name, stats)
+        return units
+
+    @classmethod
+    def from_entry(cls, entry):
+        units = {name: cls.make_unit(name, values) for name, values in entry.get("units", {}).items()}
+        return cls(units, entry.get("speed", 1.0), entry.get("unit_speed", 1.0), source=entry.get("source", "cache"))
+
+    def to_entry(self):
+        return {
+            "fetched": int(time.time()),
+            "source": self.source,
+            "speed": self.speed,
+            "unit_speed": self.unit_speed,
+            "units": {
+                name: {field: getattr(unit, field) for field in self.pool_fields}
+                for name, unit in self.units.items()
+            },
+        }
+
+    def calibrate(self):
+        """
+        Moves the world values into the simulator of the account so battles are simulated with the real numbers
+        """
+        if self.source == "defaults":
+            return
+        self.simulator.update_with_real_levels({
+            name: {pool_field: getattr(unit, field) for field, pool_field in self.pool_fields.items()}
+            for name, unit in self.units.items()
+        })
+
+    def carry(self, unit):
+        """
+        How much a single unit can haul, 0 for unknown units
+        """
+        stats = self.units.get(unit)
+        return stats.carry if stats else 0
+
+    def slowest(self, troops=None):
+        """
+        Minutes per field of the slowest unit in a {unit: amount} dict, or of any unit when no troops are given
+        """
+        speeds = [
+            self.units[unit].speed for unit, amount in (troops or {}).items()
+            if unit in self.units and amount and str(amount) != "0"
+        ]
+        if not speeds:
+            speeds = [unit.speed for unit in self.units.values()]
+        return max(speeds) if speeds else 0
+
+    def travel_time(self, distance, troops=None):
+        """
+        Seconds a group of troops needs for a distance in fields, rounded like the game does
+        """
+        return int(round(distance * self.slowest(troops) * 60))
+
+    @staticmethod
+    def distance(source, target):
+        return math.hypot(target[0] - source[0], target[1] - source[1])
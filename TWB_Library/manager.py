@@ -1,10 +1,10 @@
 import json
 import logging
-import os
 import sys
 
+from core.store import EntityStore
 from game.attack import AttackCache
-from game.reports import ReportCache
+from game.reports import FarmStats
 
 
 class VillageManager:
@@ -17,33 +17,22 @@ class VillageManager:
         if verbose:
             logger.info("Villages: %d", len(config["villages"]))
         attacks = AttackCache.cache_grab()
-        reports = ReportCache.cache_grab()
+        stats = FarmStats.cache_grab()
 
         if verbose:
-            logger.info("Reports: %d", len(reports))
+            logger.info("Reports: %d", EntityStore.get().count("reports"))
             logger.info("Farms: %d", len(attacks))
         t = {"wood": 0, "iron": 0, "stone": 0}
         for farm in attacks:
             data = attacks[farm]
+            farm_stats = stats.get(farm) or FarmStats.empty()
 
-            num_attack = []
-            loot = {"wood": 0, "iron": 0, "stone": 0}
-            total_loss_count = 0
-            total_sent_count = 0
-            for rep in reports:
-                if reports[rep]["dest"] == farm and reports[rep]["type"] == "attack":
-                    for unit in reports[rep]["extra"]["units_sent"]:
-                        total_sent_count += reports[rep]["extra"]["units_sent"][unit]
-                    for unit in reports[rep]["extra"]["units_losses"]:
-                        total_loss_count += reports[rep]["extra"]["units_losses"][unit]
-                    try:
-                        res = reports[rep]["extra"]["loot"]
-                        for r in res:
-                            loot[r] = loot[r] + int(res[r])
-                            t[r] = t[r] + int(res[r])
-                        num_attack.append(reports[rep])
-                    except:
-                        pass
+            num_attack = farm_stats["attacks"]
+            loot = farm_stats["loot"]
+            total_loss_count = farm_stats["units_lost"]
+            total_sent_count = farm_stats["units_sent"]
+            for r in t:
+                t[r] += loot.get(r, 0)
             percentage_lost = 0
 
             if total_sent_count > 0:
@@ -57,30 +46,28 @@ class VillageManager:
             if verbose:
                 logger.info(
                     "%sFarm village %s attacked %d times - Total loot: %s - Total units lost: %d (%.2f)",
-                    perf, farm, len(num_attack), str(loot), total_loss_count, percentage_lost
+                    perf, farm, num_attack, str(loot), total_loss_count, percentage_lost
                 )
-            if len(num_attack):
-                total = 0
-                for k in loot:
-                    total += loot[k]
-                if len(num_attack) > 3:
-                    if total / len(num_attack) < 100 and (
+            if num_attack:
+                total = sum(loot.values())
+                if num_attack > 3:
+                    if total / num_attack < 100 and (
                             "low_profile" not in data or not data["low_profile"]
                     ):
                         if verbose:
                             logger.info(
                                 "Farm %s has very low resources (%d avg total), extending farm time",
-                                farm, total / len(num_attack)
+                                farm, total / num_attack
                             )
                         data["low_profile"] = True
                         AttackCache.set_cache(farm, data)
-                    elif total / len(num_attack) > 500 and (
+                    elif total / num_attack > 500 and (
                             "high_profile" not in data or not data["high_profile"]
                     ):
                         if verbose:
                             logger.info(
                                 "Farm %s has very high resources (%d avg total), setting to high profile",
-                                farm, total / len(num_attack)
+                                farm, total / num_attack
                             )
                         data["high_profile"] = True
                         AttackCache.set_cache(farm, data)
@@ -90,7 +77,7 @@ class VillageManager:
                 data["low_profile"] = True
                 data["high_profile"] = False
                 AttackCache.set_cache(farm, data)
-            if percentage_lost > 50 and len(num_attack) > 10:
+            if percentage_lost > 50 and num_attack > 10:
                 logger.critical("Farm seems too dangerous/ unprofitable to farm. Setting safe to false!")
                 data["safe"] = False
                 AttackCache.set_cache(farm, data)
@@ -99,15 +86,12 @@ class VillageManager:
             logger.info("Total loot: %s" % t)
 
         if clean_reports:
-            list_of_files = sorted(["./cache/reports/" + f for f in os.listdir("./cache/reports/")],
-                                   key=os.path.getctime)
-
-            logger.info(f"Found {len(list_of_files)} files")
-
-            while len(list_of_files) > clean_reports:
-                oldest_file = list_of_files.pop(0)
-                logger.info(f"Delete old report ({oldest_file})")
-                os.remove(os.path.abspath(oldest_file))
+            store = EntityStore.get()
+            logger.info(f"Found {store.count('reports')} reports")
+            removed = FarmStats.prune_reports(keep=clean_reports)
+            if removed:
+                logger.info(f"Deleted {removed} old reports")
+        EntityStore.get().flush()
 
 
 if __name__ == "__main__":
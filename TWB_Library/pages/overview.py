@@ -1,10 +1,14 @@
 import dataclasses
 import re
+import threading
+import time
 from typing import Dict, Optional, Tuple
 
 from bs4 import BeautifulSoup
 from requests import Response
 
+from core.extractors import Extractor
+from core.filemanager import FileManager
 from core.request import WebWrapper
 
 
@@ -271,3 +275,78 @@ class OverviewPage:
             return name, coordinates, continent
         else:
             print("Invalid village string format. Skipping village...")
+
+
+class AccountSnapshot:
+    """Account-wide village state, read once per cycle from the overview_villages production table."""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self):
+        self.villages: Dict[str, Village] = {}
+        self.player: dict = {}
+        self.taken: float = 0
+
+    @classmethod
+    def get(cls) -> "AccountSnapshot":
+        """Return the snapshot of the current account."""
+        key = FileManager.get_root()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls()
+            return cls._instances[key]
+
+    def update(self, overview_page: OverviewPage) -> None:
+        """
+        Replace the snapshot with the villages and player data of a freshly parsed overview page.
+
+        Args:
+            overview_page (OverviewPage): The overview page of the current cycle.
+        """
+        game_data = Extractor.game_state(overview_page.result_get) or {}
+        self.villages = dict(overview_page.villages_data)
+        self.player = game_data.get("player", {})
+        self.taken = time.time()
+
+    @property
+    def incomings(self) -> Optional[int]:
+        """Number of incoming attacks on the whole account, None if it is unknown."""
+        incomings = self.player.get("incomings")
+        return int(incomings) if incomings is not None else None
+
+    def village_state(self, village_id: str, previous: Optional[dict] = None) -> Optional[dict]:
+        """
+        Build a game state for a village out of the production table.
+
+        Fields the table does not have (buildings, player settings...) are kept from the previous game state,
+        so consumers of the regular game state can use the result as is.
+
+        Args:
+            village_id (str): The ID of the village.
+            previous (dict): The last game state read from one of the pages of the village.
+
+        Returns:
+            dict: The game state, None if the village is not in the snapshot.
+        """
+        village = self.villages.get(str(village_id))
+        if not village:
+            return None
+        previous = previous or {}
+        state = dict(previous)
+        state["player"] = {**previous.get("player", {}), **self.player}
+        state["village"] = {
+            **previous.get("village", {}),
+            "id": int(village.village_id),
+            "name": village.village_name,
+            "x": village.coordinates.x,
+            "y": village.coordinates.y,
+            "points": village.points,
+            "wood": village.storage.wood,
+            "stone": village.storage.stone,
+            "iron": village.storage.iron,
+            "storage_max": village.storage.capacity,
+            "pop": village.farm.current,
+            "pop_max": village.farm.maximum,
+        }
+        return state
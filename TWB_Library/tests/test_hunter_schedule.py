@@ -0,0 +1,60 @@
+"""
+Hunter schedule send times
+Location: tests/test_hunter_schedule.py - Usage: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.context import AccountContext
+from core.filemanager import FileManager
+from game.hunter import HunterSchedule
+
+
+class HunterScheduleEstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        AccountContext.set_account_path(self.tmp.name)
+        self.arrival = 4102444800
+        FileManager.save_json_file({
+            "hunter_schedule": {
+                str(self.arrival): [{"id": "a1", "source": "1", "target": "2", "troops": {"axe": 10}}]
+            }
+        }, HunterSchedule.path)
+        self.durations = {}
+        self.schedule = HunterSchedule()
+
+    def tearDown(self):
+        del AccountContext._local.account_path
+        self.tmp.cleanup()
+
+    def estimate(self, source, attacks):
+        return self.durations.get(source)
+
+    def test_unknown_target_is_estimated_again(self):
+        self.assertTrue(self.schedule.refresh(self.estimate, now=0))
+        send_time, arrival, _ = self.schedule.peek()
+        self.assertEqual(send_time, arrival - HunterSchedule.unknown_duration)
+
+        # The map learned the target, the file itself did not change
+        self.durations["1"] = 300
+        self.assertFalse(self.schedule.refresh(self.estimate, now=0))
+        self.assertEqual(self.schedule.pop_due(self.arrival - HunterSchedule.unknown_duration), [])
+        due = self.schedule.pop_due(self.arrival - 300)
+        self.assertEqual([(send_time, source) for send_time, _, source, _ in due], [(self.arrival - 300, "1")])
+        self.assertFalse(self.schedule.guessed)
+
+    def test_known_target_is_not_flagged(self):
+        self.durations["1"] = 600
+        self.schedule.refresh(self.estimate, now=0)
+        self.assertFalse(self.schedule.guessed)
+        self.assertEqual(self.schedule.peek()[0], self.arrival - 600)
+
+
+if __name__ == "__main__":
+    unittest.main()
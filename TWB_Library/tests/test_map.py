@@ -0,0 +1,75 @@
+"""
+World map refresh
+Location: tests/test_map.py - Usage: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.context import AccountContext
+from core.store import EntityStore
+from game.map import WorldMap
+
+
+class FakeWrapper:
+    """Counts map page reads, the page content comes from the patched extractors"""
+
+    def __init__(self):
+        self.map_reads = 0
+
+    def get_action(self, village_id, action):
+        self.map_reads += 1
+        return object()
+
+
+def village(vid, points="100"):
+    return [vid, 0, "Village %s" % vid, points, "0", 0, 0, 0, 0, 0, 0, "0"]
+
+
+class WorldMapRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        AccountContext.set_account_path(self.tmp.name)
+        self.wrapper = FakeWrapper()
+        self.world = WorldMap(wrapper=self.wrapper)
+        self.game_state = {"village": {"x": 510, "y": 510}}
+
+    def tearDown(self):
+        EntityStore.get().conn.close()
+        EntityStore._instances.clear()
+        del AccountContext._local.account_path
+        self.tmp.cleanup()
+
+    def refresh(self, map_data):
+        with mock.patch("game.map.Extractor.map_data", return_value=map_data), \
+                mock.patch("game.map.Extractor.game_state", return_value=self.game_state):
+            return self.world.refresh("1")
+
+    def test_missing_and_empty_sectors_count_as_fetched(self):
+        # Only the own sector has villages, one neighbour came back empty and the other seven are missing
+        map_data = [
+            {"data": {"x": 500, "y": 500, "villages": [{}] * 10 + [{"10": village("1")}]}},
+            {"data": {"x": 520, "y": 500, "villages": []}},
+        ]
+        self.assertTrue(self.refresh(map_data))
+        self.assertEqual(self.wrapper.map_reads, 1)
+        self.assertTrue(self.world.covered([510, 510]))
+
+        self.refresh(map_data)
+        self.assertEqual(self.wrapper.map_reads, 1)
+
+    def test_unreadable_map_is_fetched_again(self):
+        self.assertFalse(self.refresh(None))
+        self.assertFalse(self.world.covered([510, 510]))
+        self.refresh(None)
+        self.assertEqual(self.wrapper.map_reads, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Extractor microbenchmark
+Compares the old uncompiled, uncached extraction with the compiled, per-response memoized one
+Location: tools/bench_extractors.py - Usage: python tools/bench_extractors.py [captured_page.html ...]
+"""
+
+import json
+import os
+import re
+import sys
+import timeit
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from core.extractors import Extractor
+
+
+class CapturedResponse:
+    """Stands in for a requests response, a fresh one is made per simulated request"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def legacy_game_state(res):
+    data = re.search(r'TribalWars\.updateGameData\((.+?)\);', res)
+    if data:
+        return json.loads(data.group(1), strict=False)
+
+
+def legacy_building_data(res):
+    data = re.search(r'(?s)BuildingMain.buildings = (\{.+?\});', res)
+    if data:
+        return json.loads(data.group(1), strict=False)
+
+
+def legacy_smith_data(res):
+    data = re.search(r'(?s)BuildingSmith.techs = (\{.+?\});', res)
+    if data:
+        return json.loads(data.group(1), strict=False)
+
+
+def legacy_premium_data(res):
+    data = re.search(r'(?s)PremiumExchange.receiveData\((.+?)\);', res)
+    if data:
+        return json.loads(data.group(1), strict=False)
+
+
+def legacy_recruit_data(res):
+    data = re.search(r'(?s)unit_managers.units = (\{.+?\});', res)
+    if data:
+        processed = re.sub(r'([\{\s,])(\w+)(:)', r'\1"\2"\3', data.group(1))
+        return json.loads(processed, strict=False)
+
+
+LEGACY = (legacy_game_state, legacy_building_data, legacy_smith_data, legacy_premium_data, legacy_recruit_data)
+CURRENT = (Extractor.game_state, Extractor.building_data, Extractor.smith_data,
+           Extractor.premium_data, Extractor.recruit_data)
+
+
+def synthetic_page():
+    """Builds a page of realistic size carrying every blob the extractors look for"""
+    game_data = {
+        "player": {"id": "1", "name": "bench", "premium": False},
+        "village": {"id": 1, "name": "bench", "wood": 100, "stone": 100, "iron": 100,
+                    "buildings": {name: "10" for name in ("main", "barracks", "stable", "smith", "wall")}},
+        "units": ["spear", "sword", "axe", "spy", "light", "heavy", "ram", "catapult", "snob"],
+    }
+    buildings = {name: {"id": name, "level": "10", "wood": 500, "stone": 400, "iron": 300, "pop": 5,
+                        "can_build": True, "build_time": 1200} for name in
+                 ("main", "barracks", "stable", "garage", "smith", "place", "market", "wood", "stone", "iron",
+                  "farm", "storage", "hide", "wall")}
+    techs = {"available": {unit: {"level": 1, "can_research": True} for unit in game_data["units"]}}
+    premium = {"stock": {"wood": 1000}, "capacity": {"wood": 5000}, "tax": {"buy": 0.1},
+               "constants": {"resource_base_price": 0.02}, "duration": 300, "merchants": 10}
+    units = "{" + ",".join('%s:{name:"%s",wood:50,stone:30,iron:10,pop:1}' % (u, u) for u in game_data["units"]) + "}"
+    filler = '<tr><td class="lit-item">%d</td><td><a href="/game.php?village=1&amp;screen=info_village">x</a></td></tr>\n'
+    return "".join((
+        "<html><head><script>",
+        "TribalWars.updateGameData(%s);" % json.dumps(game_data),
+        "</script></head><body><table>",
+        "".join(filler % i for i in range(6000)),
+        "</table><script>",
+        "BuildingMain.buildings = %s;" % json.dumps(buildings),
+        "BuildingSmith.techs = %s;" % json.dumps(techs),
+        "PremiumExchange.receiveData(%s);" % json.dumps(premium),
+        "unit_managers.units = %s;" % units,
+        "</script></body></html>",
+    ))
+
+
+def bench(name, text, calls, rounds):
+    """Times one simulated request where every extractor is called a few times on the same page"""
+    def legacy():
+        for _ in range(calls):
+            for extract in LEGACY:
+                extract(text)
+
+    def current():
+        response = CapturedResponse(text)
+        for _ in range(calls):
+            for extract in CURRENT:
+                extract(response)
+
+    for old, new in zip(LEGACY, CURRENT):
+        if old(text) != new(CapturedResponse(text)):
+            print("%s: %s returns different data than the legacy path" % (name, new.__name__))
+
+    old_time = min(timeit.repeat(legacy, number=1, repeat=rounds))
+    new_time = min(timeit.repeat(current, number=1, repeat=rounds))
+    print("%-32s %8.1f KB  legacy %8.2f ms  current %8.2f ms  x%.1f" % (
+        name[-32:], len(text) / 1024, old_time * 1000, new_time * 1000, old_time / new_time if new_time else 0
+    ))
+
+
+def main():
+    paths = sys.argv[1:]
+    calls = int(os.environ.get("BENCH_CALLS", 3))
+    rounds = int(os.environ.get("BENCH_ROUNDS", 20))
+    print("Each request calls every extractor %d times, best of %d rounds" % (calls, rounds))
+    if not paths:
+        bench("synthetic page", synthetic_page(), calls, rounds)
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            bench(os.path.basename(path), f.read(), calls, rounds)
+
+
+if __name__ == "__main__":
+    main()
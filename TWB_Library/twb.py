@@ -4,7 +4,6 @@ CORRIGIDO PARA SISTEMA MULTI-CONTAS
 """
 
 import collections
-import copy
 import datetime
 import json
 import logging
@@ -18,13 +17,28 @@ import traceback
 import coloredlogs
 import requests
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+    try:
+        import resource
+    except ImportError:
+        # Windows without psutil, memory usage is not reported
+        resource = None
+
 from core.notification import Notification
 from core.updater import check_update
 from core.filemanager import FileManager
 from core.request import WebWrapper
+from game.hunter import Hunter, HunterDaemon
+from game.map import MapCache, WorldMap
+from game.reports import ReportIndex, ReportManager
+from game.tasks import TaskScheduler
 from game.village import Village
+from game.world import WorldConstants
 from manager import VillageManager
-from pages.overview import OverviewPage
+from pages.overview import AccountSnapshot, OverviewPage
 from core.exceptions import UnsupportedPythonVersion
 from core.extractors import Extractor
 from analytics.growth_tracker import integrate_growth_tracker, GrowthCommands
@@ -79,6 +93,9 @@ class TWB:
     should_run = True
     runs = 0
     found_villages = []
+    reports = None
+    hunter = None
+    incomings = None
 
     @staticmethod
     def internet_online():
@@ -223,6 +240,8 @@ class TWB:
         """
         overview_page = OverviewPage(self.wrapper)
         self.found_villages = Extractor.village_ids_from_overview(overview_page.result_get.text)
+        # Resources, storage and farm of every village, the villages only read their own overview when needed
+        AccountSnapshot.get().update(overview_page)
         
         config_changed = False
         
@@ -410,14 +429,34 @@ class TWB:
 
         # Aplica user agent (já validado acima)
         self.wrapper.headers["user-agent"] = config["bot"]["user_agent"]
+        self.wrapper.page_cache.enabled = config["bot"].get("page_cache", True)
+        self.wrapper.profiler.enabled = config["bot"].get("profile_requests", True)
+        ReportIndex.horizon_days = config["bot"].get("report_horizon_days", 14)
+        ReportIndex.max_destinations = config["bot"].get("report_cache_size", 2000)
+        MapCache.max_entries = config["bot"].get("map_cache_size", 20000)
+        WorldMap.keep_radius = config["farms"].get("search_radius", 50)
 
         # Inicia wrapper
         self.wrapper.start()
+        # Unit speeds and carry capacities of this world, asked once and kept in cache/world
+        WorldConstants.get(self.wrapper, village_id=next(iter(config["villages"]), None))
+
+        # Timed attacks run on their own thread so the village cycle can not make them miss their window
+        hunter_config = config.get("hunter", {})
+        if hunter_config.get("daemon", True) and not self.hunter:
+            HunterDaemon.poll_interval = hunter_config.get("poll_interval", 30)
+            Hunter.activation_lead = hunter_config.get("activation_lead", 300)
+            Hunter.confirm_lead = hunter_config.get("confirm_lead", 10)
+            Hunter.duration_tolerance = hunter_config.get("duration_tolerance", 1)
+            Hunter.dispatch_concurrency = hunter_config.get("dispatch_concurrency", 4)
+            Hunter.dispatch_gap_ms = hunter_config.get("dispatch_gap_ms", 20)
+            self.hunter = HunterDaemon(self.wrapper)
+            self.hunter.start()
 
         # Continua com o resto do código...
+        # All villages share the account wrapper (session, page cache)
         for vid in config["villages"]:
-            v = Village(wrapper=self.wrapper, village_id=vid)
-            self.villages.append(copy.deepcopy(v))
+            self.villages.append(Village(wrapper=self.wrapper, village_id=vid))
         
         # INTEGRAR NOVO SISTEMA DE GROWTH TRACKER OTIMIZADO
         try:
@@ -427,7 +466,6 @@ class TWB:
             print(f"⚠️ Growth Tracker não ativado: {e}")
         
         # setup additional builder
-        rm = None
         defense_states = {}
         while self.should_run:
             if not self.internet_online():
@@ -447,6 +485,9 @@ class TWB:
                 )
                 time.sleep(sleep)
             else:
+                # Pages cached during the previous cycle are outdated by now
+                self.wrapper.page_cache.clear()
+                self.wrapper.profiler.start_cycle()
                 config = self.config()
                 overview_page, config = self.get_overview(config)
                 has_changed, new_cf = self.get_world_options(overview_page, config)
@@ -455,6 +496,11 @@ class TWB:
                     config = self.merge_configs(config, new_cf)
                     FileManager.save_json_file(config, "config.json")
                     print("Deployed new configuration file")
+                self.sync_reports()
+                tasks = TaskScheduler.get()
+                cycle_delay = self.cycle_delay(config)
+                tasks.interval = cycle_delay or config["bot"]["active_delay"]
+                self.check_incomings(tasks)
                 village_number = 1
                 for village in self.villages:
                     if village.village_id not in self.found_villages:
@@ -463,10 +509,6 @@ class TWB:
                             % village.village_id
                         )
                         continue
-                    if not rm:
-                        rm = village.rep_man
-                    else:
-                        village.rep_man = rm
                     if (
                             "auto_set_village_names" in config["bot"]
                             and config["bot"]["auto_set_village_names"]
@@ -481,6 +523,10 @@ class TWB:
                         template = template.replace("{num}", num_pad)
                         village.village_set_name = template
 
+                    if village.next_due(config) > time.time():
+                        # Nothing to do in this village, it does not cost a single request
+                        village_number += 1
+                        continue
                     village.run(config=config)
 
                     if (
@@ -526,12 +572,12 @@ class TWB:
                         if hasattr(self, '_daily_report_shown'):
                             delattr(self, '_daily_report_shown')
 
-                sleep = 0
-                if self.is_active_hours(config=config):
-                    sleep = config["bot"]["active_delay"]
-                else:
-                    if config["bot"]["inactive_still_active"]:
-                        sleep = config["bot"]["inactive_delay"]
+                # Wake up for the first task that is due, at most one regular delay later
+                earliest = min(
+                    (village.next_due(config) for village in self.villages if village.village_id in self.found_villages),
+                    default=float("inf")
+                )
+                sleep = min(cycle_delay, max(0, int(earliest - time.time())))
 
                 sleep += random.randint(20, 120)
                 dtn = datetime.datetime.now()
@@ -539,6 +585,8 @@ class TWB:
                 self.runs += 1
 
                 VillageManager.farm_manager(verbose=True)
+                self.wrapper.profiler.flush()
+                self.report_memory()
                 print(
                     "Dead for %.2f minutes (next run at: %s)"
                     % (sleep / 60, dt_next.time())
@@ -546,6 +594,63 @@ class TWB:
                 sys.stdout.flush()
                 time.sleep(sleep)
 
+    def cycle_delay(self, config):
+        """
+        Regular delay between two cycles, depending on the active hours
+        """
+        if self.is_active_hours(config=config):
+            return config["bot"]["active_delay"]
+        if config["bot"]["inactive_still_active"]:
+            return config["bot"]["inactive_delay"]
+        return 0
+
+    def check_incomings(self, tasks):
+        """
+        Wakes every village up when the number of incoming attacks changed, so defence is checked right away
+        """
+        incomings = AccountSnapshot.get().incomings
+        if incomings is None:
+            return
+        if self.incomings is not None and incomings != self.incomings:
+            logging.getLogger("TWB").info("Incoming attacks changed (%s -> %s), checking all villages",
+                                          self.incomings, incomings)
+            tasks.wake()
+        self.incomings = incomings
+
+    def sync_reports(self):
+        """
+        Reads the report inbox once for all villages, they share the resulting report index
+        """
+        own = {village.village_id for village in self.villages}
+        active = [vid for vid in self.found_villages if vid in own]
+        if not active:
+            return
+        if not self.reports:
+            self.reports = ReportManager(wrapper=self.wrapper, village_id=active[0])
+        self.reports.village_id = active[0]
+        try:
+            self.reports.sync(full_run=False)
+        except Exception as e:
+            logging.getLogger("Reports").warning("Unable to read reports: %s", str(e))
+
+    def report_memory(self):
+        """
+        Trims the world map and logs how much memory the process and its caches use
+        """
+        world = WorldMap.get(self.wrapper)
+        dropped = world.trim()
+        if psutil:
+            rss = "%.1f MB" % (psutil.Process().memory_info().rss / 1048576)
+        elif resource:
+            # ru_maxrss is the peak in KB on Linux
+            rss = "%.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        else:
+            rss = "unknown"
+        logging.getLogger("Memory").info(
+            "Memory: %s - map villages: %d (%d trimmed), cached villages: %d, reports in memory: %d",
+            rss, len(world.villages), dropped, len(MapCache.table()), len(ReportIndex.get())
+        )
+
     def start(self):
         """
         First run, verify if dirctory structure exist
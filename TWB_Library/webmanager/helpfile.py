@@ -17,6 +17,11 @@ help_file = {
     'bot.village_name_number_length': 'The number length, lower will be prefixed with zeroes',
     'bot.auto_set_village_names': 'Automatically set villages names',
     'bot.user_agent': 'Set this to the browser agent your session is using (otherwise could cause ban)',
+    'bot.page_cache': 'Re-use pages that were already loaded during the same cycle instead of requesting them again',
+    'bot.profile_requests': 'Log where the requests and delays of every cycle go (cache/logs/cycle_profile.json)',
+    'bot.report_horizon_days': 'Reports older than this amount of days are ignored for farm decisions',
+    'bot.report_cache_size': 'The max amount of farm destinations whose reports are kept in memory',
+    'bot.map_cache_size': 'The max amount of map villages kept in memory, the rest is read from disk when needed',
     'building.manage_buildings': 'Automatically manage buildings',
     'building': 'The automatic creation of buildings',
     'building.default': 'The default template to use, village configs override this variable',
@@ -43,6 +48,16 @@ help_file = {
     'farms.attack_higher_points': 'If enabled villages with higher points than the current one will automatically be ignored',
     'farms.force_scout_if_available': 'Will only attack villages that have either been attacked before or it will automatically scout them',
     'farms.farm_scout_amount': 'Sets the amount of spies used to determine if a village is safe to farm',
+    'farms.clear_scouted_farms': 'Attack farms where scouts found defenders with the cheapest troops that win (simulated)',
+    'farms.clear_max_losses': 'The max amount of units that may be lost when clearing a scouted farm',
+    'hunter': 'Timing of scheduled attacks (cache/hunter/scheduled_attacks.json)',
+    'hunter.daemon': 'Run scheduled attacks on their own thread instead of during the village cycle',
+    'hunter.poll_interval': 'Seconds between checks for changes of the attack schedule',
+    'hunter.activation_lead': 'Seconds before the send time an attack chain is started',
+    'hunter.confirm_lead': 'Seconds per attack the confirm page is requested before sending',
+    'hunter.duration_tolerance': 'Max difference in seconds between the calculated and the confirmed travel time',
+    'hunter.dispatch_concurrency': 'Number of connections firing attacks with the same send time at once; 1 sends them one by one',
+    'hunter.dispatch_gap_ms': 'Milliseconds between the attacks of a burst, keeps noble trains in order',
     'market': 'Automatic management of market trading',
     'market.auto_trade': 'Enable automated trading',
     'market.max_trade_duration': 'Max duration of trades (hours)',
@@ -27,11 +27,22 @@ except ImportError:
             return Path(os.getcwd()) / "config.json"
 
 
+try:
+    from core.store import EntityStore
+except ImportError:
+    EntityStore = None
+
+
 class DataReader:
     @staticmethod
     def cache_grab(cache_location):
         """Lê cache com suporte multi-conta"""
         output = {}
+
+        # Villages, attacks and reports live in the account store once the bot has migrated them
+        store_path = AccountContext.get_cache_path() / "twb.db"
+        if EntityStore and cache_location in EntityStore.legacy_dirs and store_path.exists():
+            return EntityStore.read_only(store_path, cache_location)
         
         # Usa o contexto da conta ou fallback para sistema legado
         cache_path = AccountContext.get_cache_path(cache_location)